@@ -0,0 +1,207 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from src.formula_loader import FormulaLoader
+from src.generate import DATA_DIR, DEFAULT_CHUNK_SIZE, FORMATS, FORMULA_FILE, SPLITS, get_output_path, \
+    stream_data_points
+from src.util import metrics
+from src.util.backends import validate_backend
+from src.util.columnar_store import DTYPES, is_columnar_path, replace_directory
+from src.util.dataset_store import DatasetStore
+from src.util.sampling import Sampler
+from src.util.sharding import map_as_completed
+
+# Every key a spec file may set, with the value used when it is missing
+DEFAULT_SPEC = {
+    'formula_file': FORMULA_FILE,
+    'output_dir': DATA_DIR,
+    # Formula names, underlined names or shell-style patterns matched against either
+    'formulas': ['*'],
+    'rows': {'training': 100_000, 'testing': 10_000},
+    'inf_boundary': 10000,
+    'seed': None,
+    'format': 'csv',
+    'sampling': 'uniform',
+    'scale': 'linear',
+    'sort': False,
+    'chunk_size': DEFAULT_CHUNK_SIZE,
+    'backend': 'auto',
+    'dtype': 'float64',
+}
+
+
+def load_spec(spec_file):
+    with open(spec_file, 'r') as file:
+        spec = json.load(file)
+    return validate_spec(spec)
+
+
+def validate_spec(spec):
+    unknown_keys = set(spec) - set(DEFAULT_SPEC)
+    if unknown_keys:
+        raise ValueError(f"Unknown keys in the spec: {', '.join(sorted(unknown_keys))}")
+    spec = {**DEFAULT_SPEC, **spec}
+
+    if isinstance(spec['formulas'], str):
+        spec['formulas'] = [spec['formulas']]
+    for split, num_rows in spec['rows'].items():
+        if split not in SPLITS:
+            raise ValueError(f"Split must be one of {', '.join(SPLITS)}, got: {split}")
+        if not isinstance(num_rows, int) or num_rows < 0:
+            raise ValueError(f"Rows of the {split} split must be a non-negative integer, got: {num_rows}")
+    if spec['format'] not in FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}, got: {spec['format']}")
+    if spec['dtype'] not in DTYPES:
+        raise ValueError(f"Data type must be one of {', '.join(DTYPES)}, got: {spec['dtype']}")
+    if spec['seed'] is not None and (not isinstance(spec['seed'], int) or spec['seed'] < 0):
+        raise ValueError(f"Seed must be a non-negative integer, got: {spec['seed']}")
+    if spec['chunk_size'] < 1:
+        raise ValueError("Chunk size must be at least 1.")
+    # Raises for an unknown sampling method, scale or backend
+    Sampler(spec['sampling'], spec['scale'])
+    validate_backend(spec['backend'])
+    return spec
+
+
+def get_spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def select_formulas(formula_loader, patterns):
+    # Keep the order of the formula file, every pattern must match at least one formula
+    formulas = formula_loader.list_formulas()
+    selected = []
+    for pattern in patterns:
+        matches = [formula for formula in formulas
+                   if fnmatch.fnmatchcase(formula.name, pattern)
+                   or fnmatch.fnmatchcase(formula.get_name_with_underline(), pattern)]
+        if not matches:
+            raise ValueError(f"No formula matches: {pattern}")
+        selected += [formula for formula in matches if formula not in selected]
+    return [formula for formula in formulas if formula in selected]
+
+
+def get_task_id(formula, split):
+    return f'{formula.get_name_with_underline()}/{split}'
+
+
+def get_task_seed(seed, formula, split):
+    # Every task gets its own random stream that does not depend on which other formulas are selected
+    if seed is None:
+        return None
+    return [seed, zlib.crc32(get_task_id(formula, split).encode('utf-8'))]
+
+
+def get_tasks(spec):
+    formulas = select_formulas(FormulaLoader(spec['formula_file']), spec['formulas'])
+    sampler = Sampler(spec['sampling'], spec['scale'])
+    tasks = []
+    for formula in formulas:
+        formula.backend = spec['backend']
+        for split in SPLITS:
+            num_rows = spec['rows'].get(split, 0)
+            if num_rows == 0:
+                continue
+            output_path = get_output_path(formula, split, spec['output_dir'], spec['format'])
+            tasks.append((get_task_id(formula, split), formula, output_path, num_rows, spec['inf_boundary'],
+                          get_task_seed(spec['seed'], formula, split), spec['chunk_size'], spec['sort'], sampler,
+                          spec['dtype']))
+    return tasks
+
+
+def load_manifest(manifest_file, spec_hash, restart=False):
+    # The manifest only applies to the spec it was written for, a changed spec must be restarted explicitly
+    if restart or not os.path.exists(manifest_file):
+        return {'spec_hash': spec_hash, 'tasks': {}}
+    with open(manifest_file, 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('spec_hash') != spec_hash:
+        raise ValueError(f"{manifest_file} was written for a different spec, use --restart to start over")
+    return manifest
+
+
+def save_manifest(manifest_file, manifest):
+    # The manifest is rewritten after every task, an interrupted run never leaves it half-written
+    metrics.write_atomically(manifest_file, json.dumps(manifest, indent=4))
+
+
+def is_task_completed(manifest, task_id):
+    entry = manifest['tasks'].get(task_id)
+    return entry is not None and os.path.exists(entry['output'])
+
+
+def run_task(task_id, formula, output_path, num_rows, inf_boundary, seed, chunk_size, sort, sampler, dtype):
+    # The rows are written to a temporary file, so an interrupted task never leaves a partial output behind.
+    # The temporary file keeps the extension of the output, which selects its format.
+    start_time = time.perf_counter()
+    root, extension = os.path.splitext(output_path)
+    temp_file = root + '.partial' + extension
+    with metrics.use_metrics(metrics.RunMetrics()) as task_metrics:
+        stream_data_points(formula, temp_file, num_rows, inf_boundary, seed, chunk_size, sort=sort,
+                           sampler=sampler, dtype=dtype)
+    if is_columnar_path(output_path):
+        replace_directory(temp_file, output_path)
+    else:
+        os.replace(temp_file, output_path)
+    DatasetStore(output_path).clear_segments()
+    return task_id, output_path, num_rows, time.perf_counter() - start_time, task_metrics.snapshot()
+
+
+def run_batch(spec, manifest_file, workers=1, restart=False, progress_callback=None):
+    manifest = load_manifest(manifest_file, get_spec_hash(spec), restart)
+    save_manifest(manifest_file, manifest)
+    tasks = get_tasks(spec)
+    pending = [task for task in tasks if not is_task_completed(manifest, task[0])]
+
+    completed = len(tasks) - len(pending)
+    for task_id, output_path, num_rows, seconds, task_metrics in map_as_completed(run_task, pending, workers):
+        metrics.get_metrics().merge(task_metrics)
+        manifest['tasks'][task_id] = {'output': output_path, 'rows': num_rows, 'seconds': seconds,
+                                      'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        save_manifest(manifest_file, manifest)
+        completed += 1
+        if progress_callback is not None:
+            progress_callback(completed, len(tasks), task_id, num_rows, seconds)
+    return manifest
+
+
+def print_progress(completed, num_tasks, task_id, num_rows, seconds):
+    print(f"[{completed}/{num_tasks}] {task_id}: {num_rows} data points in {seconds:.1f}s")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the training and testing data of many formulas.')
+    parser.add_argument('spec', help='json spec file with the formulas, rows per split, inf boundary, seed, '
+                                     'sampling and format')
+    parser.add_argument('--manifest', default=None,
+                        help='checkpoint manifest of the completed tasks, defaults to <spec>.manifest.json')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of tasks run in parallel, 0 uses one per cpu')
+    parser.add_argument('--restart', action='store_true', help='ignore the manifest and run every task again')
+    parser.add_argument('--metrics-report', default=None,
+                        help='write stage durations, rows, bytes written and peak memory to this json file')
+    arguments = parser.parse_args(argv)
+    if arguments.workers < 0:
+        parser.error('--workers must not be negative')
+    return arguments
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    spec = load_spec(arguments.spec)
+    manifest_file = arguments.manifest or os.path.splitext(arguments.spec)[0] + '.manifest.json'
+    with metrics.get_metrics().stage('total'):
+        manifest = run_batch(spec, manifest_file, arguments.workers, arguments.restart, print_progress)
+
+    if arguments.metrics_report is not None:
+        metrics.get_metrics().write_report(arguments.metrics_report)
+    print(f"Completed {len(manifest['tasks'])} tasks, manifest written to {manifest_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.entity.regressed_model import RegressedModel
+from src.formula_loader import FormulaLoader
+from src.generate import FORMULA_FILE, find_formula, get_output_path
+from src.util.dataset_store import get_current_dataset_path, get_dataset_columns, iter_column_chunks, load_columns
+from src.util.error_metrics import ErrorAccumulator, calculate_metrics
+from src.util.sharding import get_worker_count, map_in_order
+
+RESULT_COLUMNS = ['rank', 'expression', 'ssr', 'r_squared', 'rmse', 'max_error', 'error']
+CANDIDATES_PER_TASK = 64
+RESIDUAL_SAMPLE_SIZE = 100_000
+
+# Test sets loaded in this process, keyed by file path and validated against the file modification time
+_test_set_cache = {}
+# Test set used by the candidates scored in a worker process
+_worker_test_set = None
+
+
+def load_test_set(file_path):
+    mtime = os.path.getmtime(file_path)
+    cached = _test_set_cache.get(file_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    expected_result, input_columns = load_columns(file_path)
+
+    _test_set_cache[file_path] = (mtime, (expected_result, input_columns))
+    return expected_result, input_columns
+
+
+def read_candidates(candidates_file):
+    # One expression per line, blank lines and lines starting with '#' are skipped
+    with open(candidates_file, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+
+
+def score_model(expression, expected_result, input_columns):
+    result = {'expression': expression, 'ssr': np.nan, 'r_squared': np.nan, 'rmse': np.nan, 'max_error': np.nan,
+              'error': ''}
+    try:
+        model = RegressedModel(RegressedModel.clean_expression(expression), input_columns.keys())
+        fitted_result = model.evaluate(input_columns)
+    except (ValueError, RecursionError) as e:
+        result['error'] = str(e)
+        return result
+
+    # A model that is undefined anywhere on the test set is reported instead of scored
+    non_finite = np.count_nonzero(~np.isfinite(fitted_result))
+    if non_finite:
+        result['error'] = f"{non_finite} non-finite values"
+        return result
+
+    metrics = calculate_metrics(expected_result, fitted_result)
+    result.update({key: metrics[key] for key in ('ssr', 'r_squared', 'rmse', 'max_error')})
+    return result
+
+
+def init_worker(test_file):
+    global _worker_test_set
+    _worker_test_set = load_test_set(test_file)
+
+
+def score_candidates_in_worker(expressions):
+    return [score_model(expression, *_worker_test_set) for expression in expressions]
+
+
+def rank_results(results):
+    import pandas as pd
+
+    # Best SSR first, models that could not be scored go last in their input order
+    results = pd.DataFrame(results, columns=RESULT_COLUMNS[1:])
+    results = results.sort_values(by='ssr', kind='stable', na_position='last').reset_index(drop=True)
+    results.insert(0, 'rank', np.arange(1, len(results) + 1))
+    return results
+
+
+def batch_verify(candidates, test_file, workers=1):
+    workers = get_worker_count(workers)
+    if workers == 1 or len(candidates) <= CANDIDATES_PER_TASK:
+        expected_result, input_columns = load_test_set(test_file)
+        return rank_results([score_model(expression, expected_result, input_columns) for expression in candidates])
+
+    # Every worker loads the test set once and scores batches of candidates against it
+    batches = [candidates[i:i + CANDIDATES_PER_TASK] for i in range(0, len(candidates), CANDIDATES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(test_file,)) as executor:
+        results = [result for batch in executor.map(score_candidates_in_worker, batches) for result in batch]
+    return rank_results(results)
+
+
+def batch_verify_streaming(candidates, test_file, chunk_size, reservoir_size=0, seed=None, workers=1):
+    workers = get_worker_count(workers)
+    if workers == 1 or len(candidates) <= CANDIDATES_PER_TASK:
+        results, accumulators = score_candidates_streaming(candidates, test_file, chunk_size, reservoir_size, seed)
+        return rank_results(results), accumulators
+
+    # Every worker streams the test file once for its share of the candidates
+    batch_size = -(-len(candidates) // workers)
+    tasks = [(candidates[i:i + batch_size], test_file, chunk_size, reservoir_size, seed)
+             for i in range(0, len(candidates), batch_size)]
+    results = []
+    accumulators = {}
+    for batch_results, batch_accumulators in map_in_order(score_candidates_streaming, tasks, workers):
+        results += batch_results
+        accumulators.update(batch_accumulators)
+    return rank_results(results), accumulators
+
+
+def score_candidates_streaming(candidates, test_file, chunk_size, reservoir_size=0, seed=None):
+    # Read the test file one chunk at a time and update one accumulator per model, memory use does not
+    # depend on the size of the test set
+    columns = get_dataset_columns(test_file) or []
+    variable_symbols = [column_name.split(' ')[0] for column_name in columns[1:]]
+    models = {}
+    errors = {}
+    for expression in candidates:
+        try:
+            models[expression] = RegressedModel(RegressedModel.clean_expression(expression), variable_symbols)
+        except (ValueError, RecursionError) as e:
+            errors[expression] = str(e)
+    accumulators = {expression: ErrorAccumulator(reservoir_size, seed) for expression in models}
+    non_finite = dict.fromkeys(models, 0)
+
+    for expected_result, input_columns in iter_column_chunks(test_file, chunk_size):
+        for expression, model in models.items():
+            fitted_result = model.evaluate(input_columns)
+            non_finite[expression] += np.count_nonzero(~np.isfinite(fitted_result))
+            accumulators[expression].update(expected_result, fitted_result)
+
+    results = []
+    for expression in candidates:
+        result = {'expression': expression, 'ssr': np.nan, 'r_squared': np.nan, 'rmse': np.nan,
+                  'max_error': np.nan, 'error': errors.get(expression, '')}
+        if not result['error'] and non_finite[expression]:
+            result['error'] = f"{non_finite[expression]} non-finite values"
+        elif not result['error']:
+            metrics = accumulators[expression].get_metrics()
+            result.update({key: metrics[key] for key in ('ssr', 'r_squared', 'rmse', 'max_error')})
+        results.append(result)
+    return results, accumulators
+
+
+def plot_best_models(results, test_file, plot_dir, count=1, chunk_size=1_000_000):
+    from src.plotter import plot_residual_diagnostics
+
+    # Draw the residual diagnostics of the best scored models to png files, without a display
+    if not os.path.exists(plot_dir):
+        os.makedirs(plot_dir)
+    scored = results[~results['error'].astype(bool)].head(count)
+    for rank, expression in zip(scored['rank'], scored['expression']):
+        _, accumulators = batch_verify_streaming([expression], test_file, chunk_size, RESIDUAL_SAMPLE_SIZE)
+        fitted_result, residuals = accumulators[expression].get_residual_sample()
+        plot_residual_diagnostics(residuals, fitted_result, os.path.join(plot_dir, f'model_{rank}'))
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Score many candidate models against the test data of a formula.')
+    parser.add_argument('formula', help='formula name, e.g. "I.25.13: Capacitance" or I.25.13_Capacitance')
+    parser.add_argument('candidates', help='text file with one candidate expression per line')
+    parser.add_argument('--test-file', default=None,
+                        help='test csv file or columnar dataset (.cols), defaults to data/testing_data/')
+    parser.add_argument('--formula-file', default=FORMULA_FILE, help='formula json file')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes, 0 uses one per cpu')
+    parser.add_argument('-o', '--output', default=None, help='write the ranked table to this csv file')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='score the test file in chunks of this many rows instead of loading it into memory')
+    parser.add_argument('--top', type=int, default=20, help='number of ranked models to print')
+    parser.add_argument('--plot-dir', default=None, help='write residual diagnostic plots of the best models here')
+    parser.add_argument('--plot-top', type=int, default=1, help='number of best models to plot')
+    arguments = parser.parse_args(argv)
+    if arguments.workers < 0:
+        parser.error('--workers must not be negative')
+    if arguments.chunk_size is not None and arguments.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    return arguments
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    test_file = arguments.test_file
+    if test_file is None:
+        formula = find_formula(FormulaLoader(arguments.formula_file), arguments.formula)
+        test_file = get_output_path(formula, 'testing')
+        # An up-to-date columnar copy of the test data is memory-mapped instead of parsing the csv file
+        test_file = get_current_dataset_path(test_file)
+
+    if arguments.chunk_size is not None:
+        results, _ = batch_verify_streaming(read_candidates(arguments.candidates), test_file, arguments.chunk_size,
+                                            workers=arguments.workers)
+    else:
+        results = batch_verify(read_candidates(arguments.candidates), test_file, arguments.workers)
+    if arguments.output is not None:
+        results.to_csv(arguments.output, index=False)
+
+    if arguments.plot_dir is not None:
+        plot_best_models(results, test_file, arguments.plot_dir, arguments.plot_top, arguments.chunk_size or 1_000_000)
+
+    print(results.head(arguments.top).to_string(index=False))
+    failed = results['error'].astype(bool).sum()
+    print(f"Scored {len(results) - failed} of {len(results)} models, {failed} could not be scored")
+
+
+if __name__ == "__main__":
+    main()
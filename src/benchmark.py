@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from src.entity.regressed_model import RegressedModel
+from src.formula_loader import FormulaLoader
+from src.generate import FORMULA_FILE, sort_data_points, write_chunks
+from src.util.dataset_store import DatasetStore, split_columns
+from src.util.error_metrics import calculate_metrics
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the results then have no peak resident memory
+    resource = None
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+STAGES = ['sampling', 'evaluation', 'sorting', 'writing', 'loading', 'scoring']
+DEFAULT_THRESHOLD = 0.2
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_stage(timings, stage, function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    timings[stage] = time.perf_counter() - start_time
+    return result
+
+
+def run_case(formula_file, formula_name, num_rows, inf_boundary, seed):
+    # Runs in a fresh process, so the peak memory of one case is not hidden by the cases before it
+    # Import pandas and compile the formula up front, so one-off startup costs are not timed as a stage
+    import pandas  # noqa: F401
+
+    formula = FormulaLoader(formula_file).get_formula(formula_name)
+    formula.compile()
+    rng = np.random.default_rng(seed)
+    timings = {}
+
+    columns = time_stage(timings, 'sampling', lambda: [var.domain.sample(num_rows, rng, inf_boundary)
+                                                       for var in formula.independent_variables])
+    results = time_stage(timings, 'evaluation', formula.evaluate_batch, columns)
+    data_points = np.column_stack([results] + columns)
+    data_points = time_stage(timings, 'sorting', sort_data_points, data_points)
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as temp_dir:
+        file_name = os.path.join(temp_dir, 'data.csv')
+        time_stage(timings, 'writing', write_chunks, [data_points], file_name,
+                   formula.get_variable_symbol_with_units())
+        bytes_written = os.path.getsize(file_name)
+        del data_points, columns, results
+        data_frame = time_stage(timings, 'loading', DatasetStore(file_name).load_data_frame)
+
+    # Score the formula itself as the regressed model, as the verifier would
+    expected_result, input_columns = split_columns(data_frame)
+    try:
+        model = RegressedModel(formula.equation, input_columns.keys())
+        time_stage(timings, 'scoring', lambda: calculate_metrics(expected_result, model.evaluate(input_columns)))
+    except ValueError:
+        pass
+
+    result = {
+        'formula': formula_name,
+        'rows': num_rows,
+        'bytes_written': bytes_written,
+        'stages': {stage: {'seconds': seconds, 'rows_per_second': num_rows / seconds if seconds > 0 else None}
+                   for stage, seconds in timings.items()},
+    }
+    if resource is not None:
+        result['peak_rss_mb'] = get_peak_rss_mb()
+    return result
+
+
+def run_benchmark(formula_file=FORMULA_FILE, sizes=None, inf_boundary=10000, seed=0, formula_names=None):
+    formula_names = formula_names or [formula.name for formula in FormulaLoader(formula_file).list_formulas()]
+    results = []
+    for formula_name in formula_names:
+        for num_rows in sizes or DEFAULT_SIZES:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(run_case, formula_file, formula_name, num_rows, inf_boundary, seed).result()
+            results.append(result)
+            print(format_result(result), flush=True)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def format_result(result):
+    stages = '  '.join(f"{stage} {result['stages'][stage]['rows_per_second']:,.0f}"
+                       for stage in STAGES if stage in result['stages'])
+    peak_rss = f" | {result['peak_rss_mb']:.0f} MB" if 'peak_rss_mb' in result else ''
+    return f"{result['formula']} | {result['rows']:,} rows{peak_rss} | rows/s: {stages}"
+
+
+def compare_results(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # A stage regressed when its throughput dropped by more than the threshold fraction of the baseline
+    baseline_stages = {(result['formula'], result['rows'], stage): values['rows_per_second']
+                       for result in baseline['results'] for stage, values in result['stages'].items()}
+    regressions = []
+    for result in current['results']:
+        for stage, values in result['stages'].items():
+            baseline_rate = baseline_stages.get((result['formula'], result['rows'], stage))
+            if baseline_rate and values['rows_per_second'] is not None \
+                    and values['rows_per_second'] < (1 - threshold) * baseline_rate:
+                regressions.append({'formula': result['formula'], 'rows': result['rows'], 'stage': stage,
+                                    'baseline_rows_per_second': baseline_rate,
+                                    'rows_per_second': values['rows_per_second']})
+    return regressions
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark generation, evaluation, I/O and scoring of every formula.')
+    parser.add_argument('--formula-file', default=FORMULA_FILE, help='formula json file')
+    parser.add_argument('--formula', action='append', default=None, help='only benchmark this formula, repeatable')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='row counts to benchmark')
+    parser.add_argument('--inf-boundary', type=float, default=10000, help='boundary value used for infinity')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the sampled data')
+    parser.add_argument('-o', '--output', default=None, help='write the results to this json file')
+    parser.add_argument('--compare', default=None, help='baseline json file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed throughput drop against the baseline, as a fraction')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    results = run_benchmark(arguments.formula_file, arguments.sizes, arguments.inf_boundary, arguments.seed,
+                            arguments.formula)
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=4)
+
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare_results(results, baseline, arguments.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression['formula']} | {regression['rows']:,} rows | {regression['stage']}: "
+                  f"{regression['rows_per_second']:,.0f} rows/s, "
+                  f"baseline {regression['baseline_rows_per_second']:,.0f}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {arguments.threshold:.0%} against {arguments.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import os
+
+from src.util.columnar_store import COLUMNAR_EXTENSION, columnar_to_csv, csv_to_columnar, is_columnar_path
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def convert(input_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    # The direction follows the input, columnar datasets end with .cols
+    if is_columnar_path(input_file):
+        return columnar_to_csv(input_file, output_file, chunk_size)
+    return csv_to_columnar(input_file, output_file, chunk_size)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Convert data files between csv and columnar datasets (.cols).')
+    parser.add_argument('input', help='csv file or columnar dataset to convert')
+    parser.add_argument('output', nargs='?', default=None,
+                        help='output file, defaults to the input with the other extension')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows converted at a time')
+    arguments = parser.parse_args(argv)
+    if arguments.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    return arguments
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    output_file = arguments.output
+    if output_file is None:
+        extension = '.csv' if is_columnar_path(arguments.input) else COLUMNAR_EXTENSION
+        output_file = os.path.splitext(arguments.input.rstrip('/\\'))[0] + extension
+    convert(arguments.input, output_file, arguments.chunk_size)
+    print(f"Converted {arguments.input} to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
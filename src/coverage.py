@@ -0,0 +1,46 @@
+import argparse
+
+from src.formula_loader import FormulaLoader
+from src.generate import FORMULA_FILE, find_formula
+from src.util.sampling import SAMPLING_METHODS, SCALES, Sampler
+
+DEFAULT_SIZES = [256, 1024, 4096]
+
+
+def compare_sampling_methods(formula, sizes, methods=SAMPLING_METHODS, scale='linear', inf_boundary=10000, seed=0):
+    # The discrepancy of every method is measured in the same space, so the numbers can be compared directly
+    results = []
+    for method in methods:
+        sampler = Sampler(method, scale)
+        for size in sizes:
+            data_points = formula.generate_random_data_points(size, inf_boundary, seed, sampler=sampler)
+            results.append({'method': method, 'rows': size,
+                            'discrepancy': formula.calculate_discrepancy(data_points, inf_boundary, sampler)})
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Compare how evenly the sampling methods cover a formula domain.')
+    parser.add_argument('formula', help='formula name, e.g. "I.25.13: Capacitance" or I.25.13_Capacitance')
+    parser.add_argument('--formula-file', default=FORMULA_FILE, help='formula json file')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='row counts to compare')
+    parser.add_argument('--methods', choices=SAMPLING_METHODS, nargs='+', default=list(SAMPLING_METHODS),
+                        help='sampling methods to compare')
+    parser.add_argument('--scale', choices=SCALES, default='linear', help='scale of the sampled ranges')
+    parser.add_argument('--inf-boundary', type=float, default=10000, help='boundary value used for infinity')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the sampled data')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    formula = find_formula(FormulaLoader(arguments.formula_file), arguments.formula)
+    results = compare_sampling_methods(formula, arguments.sizes, arguments.methods, arguments.scale,
+                                       arguments.inf_boundary, arguments.seed)
+    # Lower centered L2 discrepancy means the rows cover the domain more evenly
+    for result in results:
+        print(f"{result['method']:<16} {result['rows']:>10,} rows  discrepancy {result['discrepancy']:.3e}")
+
+
+if __name__ == "__main__":
+    main()
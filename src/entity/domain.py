@@ -1,45 +1,74 @@
 import random
 
+import numpy as np
+
+
 class Domain:
+    # Domains are created for every variable of every formula, so keep the instances compact
+    __slots__ = ('type', 'range', 'lower_bound', 'upper_bound')
+
     def __init__(self, domain_type, domain_range):
         self.type = domain_type
         self.range = domain_range
+        # Parse the range string once, infinite bounds are kept as float('inf')
+        self.lower_bound, self.upper_bound = self.parse_range(domain_range)
 
     def __repr__(self):
         return f"Domain(type={self.type}, range={self.range})"
 
+    @staticmethod
+    def parse_range(domain_range):
+        bounds = domain_range.strip('[]').split(',')
+        if len(bounds) != 2:
+            raise ValueError(f"Invalid domain range: {domain_range}")
+        return float(bounds[0]), float(bounds[1])
+
+    def get_finite_bounds(self, bound_for_inf=10000):
+        # Replace infinite bounds with the given boundary value
+        lower_bound = -bound_for_inf if self.lower_bound == -float('inf') else self.lower_bound
+        upper_bound = bound_for_inf if self.upper_bound == float('inf') else self.upper_bound
+        return lower_bound, upper_bound
+
     def is_valid_value(self, value):
         if self.type == 'real':
-            bounds = self.range.strip('[]').split(',')
-            lower_bound, upper_bound = float(bounds[0]), float(bounds[1])
-            return lower_bound <= value <= upper_bound
+            return self.lower_bound <= value <= self.upper_bound
 
         elif self.type == 'integer':
-            if not isinstance(value, int):
+            if not isinstance(value, (int, np.integer)):
                 return False
-            bounds = self.range.strip('[]').split(',')
-            lower_bound, upper_bound = int(bounds[0]), int(bounds[1])
-            return lower_bound <= value <= upper_bound
+            return self.lower_bound <= value <= self.upper_bound
 
         return False
 
+    def get_valid_mask(self, values):
+        # Vectorized is_valid_value, NaN and infinite values are never valid
+        values = np.asarray(values)
+        with np.errstate(invalid='ignore'):
+            mask = np.isfinite(values) & (values >= self.lower_bound) & (values <= self.upper_bound)
+            if self.type == 'integer':
+                mask &= np.floor(values) == values
+            elif self.type != 'real':
+                mask[:] = False
+        return mask
+
     def get_random_input(self, bound_for_inf=10000):
+        lower_bound, upper_bound = self.get_finite_bounds(bound_for_inf)
         if self.type == 'real':
-            bounds = self.range.strip('[]').split(',')
-            lower_bound, upper_bound = float(bounds[0]), float(bounds[1])
-            if lower_bound == -float('inf'):
-                lower_bound = -bound_for_inf
-            if upper_bound == float('inf'):
-                upper_bound = bound_for_inf
             return random.uniform(lower_bound, upper_bound)
 
         elif self.type == 'integer':
-            bounds = self.range.strip('[]').split(',')
-            lower_bound, upper_bound = int(bounds[0]), int(bounds[1])
-            if lower_bound == -int('inf'):
-                lower_bound = -bound_for_inf
-            if upper_bound == int('inf'):
-                upper_bound = bound_for_inf
-            return random.randint(lower_bound, upper_bound)
+            return random.randint(int(lower_bound), int(upper_bound))
 
         return None
+
+    def sample(self, n, rng=None, bound_for_inf=10000):
+        # rng can be a numpy Generator or a seed, the same seed always gives the same samples
+        rng = np.random.default_rng(rng)
+        lower_bound, upper_bound = self.get_finite_bounds(bound_for_inf)
+        if self.type == 'real':
+            return rng.uniform(lower_bound, upper_bound, size=n)
+
+        elif self.type == 'integer':
+            return rng.integers(int(lower_bound), int(upper_bound), size=n, dtype=np.int64, endpoint=True)
+
+        raise ValueError(f"Unsupported domain type: {self.type}")
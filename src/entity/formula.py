@@ -1,13 +1,55 @@
-import sympy
+import numpy as np
+
+from src.entity.variable import Variable
+from src.util import metrics
+from src.util.backends import AUTO_BACKEND, choose_backend, get_default_backend, is_exactly_rounded, validate_backend
+from src.util.columnar_store import allocate_columns
 from src.util.constant_handler import ConstantHandler
+from src.util.kernel_cache import compile_kernel
+from src.util.sampling import calculate_discrepancy, default_sampler
+
+# Generation fails when fewer candidate rows than this are valid, once enough candidates were drawn to tell
+DEFAULT_MIN_ACCEPTANCE_RATE = 0.01
+MIN_CANDIDATES_FOR_ACCEPTANCE = 1000
 
 
 class Formula:
     def __init__(self, name, equation, independent_variables, dependent_variable):
         self.name = name
         self.equation = equation
-        self.independent_variables = independent_variables
-        self.dependent_variable = dependent_variable
+        # Variables may be given as Variable objects or as their serialized dictionaries,
+        # dictionaries are only turned into Variable objects when the variables are first used
+        self._independent_variables = independent_variables
+        self._dependent_variable = dependent_variable
+        # Vectorized callables built from the equation for every backend, created lazily by compile()
+        self._kernels = {}
+        # 'auto' picks the backend from the size of the equation and of every batch
+        self.backend = get_default_backend()
+        # Backends that failed to compile or evaluate this formula
+        self._rejected_backends = set()
+
+    @property
+    def independent_variables(self):
+        if any(isinstance(var, dict) for var in self._independent_variables):
+            self._independent_variables = [Variable.from_dict(var) if isinstance(var, dict) else var
+                                           for var in self._independent_variables]
+        return self._independent_variables
+
+    @independent_variables.setter
+    def independent_variables(self, independent_variables):
+        self._independent_variables = independent_variables
+        self._kernels = {}
+        self._rejected_backends = set()
+
+    @property
+    def dependent_variable(self):
+        if isinstance(self._dependent_variable, dict):
+            self._dependent_variable = Variable.from_dict(self._dependent_variable)
+        return self._dependent_variable
+
+    @dependent_variable.setter
+    def dependent_variable(self, dependent_variable):
+        self._dependent_variable = dependent_variable
 
     def __str__(self):
         return (f"{self.name}: {self.equation}, Independent Variables: "
@@ -23,43 +65,176 @@ class Formula:
             return self.name == other.name and self.equation == other.equation
         return False
 
+    def __getstate__(self):
+        # The compiled kernels cannot be pickled, worker processes compile their own copy
+        state = self.__dict__.copy()
+        state['_kernels'] = {}
+        return state
+
+    def get_key(self):
+        # Two formulas are the same formula when their name and equation match, see __eq__
+        return self.name, self.equation
+
+    def to_dict(self):
+        # Variables that were never used are written back as they were read
+        return {
+            'name': self.name,
+            'equation': self.equation,
+            'independent_variables': [var if isinstance(var, dict) else var.to_dict()
+                                      for var in self._independent_variables],
+            'dependent_variable': (self._dependent_variable if isinstance(self._dependent_variable, dict)
+                                   else self._dependent_variable.to_dict())
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=data['name'],
+            equation=data['equation'],
+            independent_variables=data['independent_variables'],
+            dependent_variable=data['dependent_variable']
+        )
+
     def get_name_with_underline(self):
         return self.name.replace(" ", "_").replace(":", "")
 
+    def compile(self, backend='numpy'):
+        if backend not in self._kernels:
+            # The kernel is loaded from the on-disk cache when possible, sympy only parses it on a cache miss
+            symbols = [var.symbol for var in self.independent_variables]
+            constants = ConstantHandler.get_constant_bindings(self.equation, symbols)
+            self._kernels[backend] = compile_kernel(self.equation, symbols, constants, backend=backend)
+        return self._kernels[backend]
+
+    def get_backend(self, num_rows):
+        backend = validate_backend(self.backend)
+        if backend == AUTO_BACKEND:
+            backend = choose_backend(self.equation, num_rows)
+        # Only equations every backend rounds identically leave numpy, so the results never depend on the backend
+        if backend in self._rejected_backends or not is_exactly_rounded(self.equation):
+            return 'numpy'
+        return backend
+
+    def evaluate_batch(self, arrays, backend=None):
+        if len(arrays) != len(self.independent_variables):
+            raise ValueError("Number of columns must match the number of independent variables.")
+
+        columns = [np.asarray(column, dtype=np.float64) for column in arrays]
+        # A constant equation evaluates to a scalar, so broadcast it to the length of the columns
+        shape = np.broadcast_shapes(*(column.shape for column in columns)) if columns else ()
+        backend = backend or self.get_backend(shape[0] if shape else 1)
+
+        result = None
+        if backend != 'numpy':
+            result = self.evaluate_with_backend(backend, columns, shape)
+        if result is None:
+            try:
+                with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                    result = self.compile()(*columns)
+            except Exception as e:
+                raise ValueError(f"Error calculating the data points: {e}")
+
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), shape).copy()
+
+    def evaluate_with_backend(self, backend, columns, shape):
+        # Returns None when the backend cannot compile or evaluate the equation, numpy is then used for this
+        # formula from now on
+        try:
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                return np.broadcast_to(np.asarray(self.compile(backend)(*columns), dtype=np.float64), shape)
+        except Exception:
+            self._rejected_backends.add(backend)
+            metrics.increment('backend_fallbacks')
+            return None
+
     def calculate_data_point(self, values):
         if len(values) != len(self.independent_variables):
             raise ValueError("Number of values must match the number of independent variables.")
 
-        # Create a dictionary to store the variable values
-        variable_values = {var.symbol: value for var, value in zip(self.independent_variables, values)}
-
-        # Replace constants in the equation with their values
-        for var_symbol, value in variable_values.items():
-            if isinstance(value, str) and value in ConstantHandler.get_constant_value(var_symbol):
-                variable_values[var_symbol] = ConstantHandler.get_constant_value(value)
-
-        try:
-            # Use simplify to convert the equation to a sympy expression
-            equation_expr = sympy.sympify(self.equation)
-
-            # Substitute the variable values into the expression
-            result = equation_expr.subs(variable_values)
-            return result.evalf()  # Evaluate the expression to get the numerical result
-        except Exception as e:
-            raise ValueError(f"Error calculating the data point: {e}")
-
-    def generate_random_data_point(self, bound=10000):
-        random_values = [var.domain.get_random_input(bound) for var in self.independent_variables]
-
-        result = [self.calculate_data_point(random_values)]
-        for random_value in random_values:
-            result.append(random_value)
-
-        return result
+        # Evaluate the single data point as a batch of one row, constants are bound when compiling
+        return float(self.evaluate_batch([[value] for value in values])[0])
+
+    def generate_candidates(self, num_candidates, bound=10000, rng=None, sampler=None, dtype=np.float64,
+                            out=None):
+        # Sample every independent variable as a whole column, seeding rng makes the data reproducible
+        sampler = sampler or default_sampler
+        with metrics.stage('sampling'):
+            domains = [var.domain for var in self.independent_variables]
+            columns = sampler.sample(domains, num_candidates, rng, bound)
+
+        # Dependent variable first, followed by the independent variables. The dependent variable is evaluated
+        # from the stored values, so it matches them when they are rounded to float32.
+        candidates = allocate_columns(num_candidates, len(columns) + 1, dtype) if out is None else out
+        for i, column in enumerate(columns):
+            candidates[:, i + 1] = column
+        with metrics.stage('evaluation'):
+            candidates[:, 0] = self.evaluate_batch([candidates[:, i + 1] for i in range(len(columns))])
+
+        return candidates
+
+    def get_valid_mask(self, data_points):
+        # A row is valid when every value is finite and inside the domain of its variable
+        variables = [self.dependent_variable] + self.independent_variables
+        mask = np.ones(len(data_points), dtype=bool)
+        for i, var in enumerate(variables):
+            mask &= var.domain.get_valid_mask(data_points[:, i])
+        return mask
+
+    def generate_random_data_points(self, num_data_points, bound=10000, rng=None,
+                                    min_acceptance_rate=DEFAULT_MIN_ACCEPTANCE_RATE, sampler=None, dtype=np.float64):
+        # Rejected rows are replaced by sampling new candidates until there are exactly num_data_points valid rows.
+        # When every row is valid this draws the same random numbers as sampling a single block.
+        rng = np.random.default_rng(rng)
+        data_points = allocate_columns(num_data_points, len(self.independent_variables) + 1, dtype)
+        num_valid = 0
+        num_found = 0
+        num_candidates = 0
+        block_size = num_data_points
+        while num_valid < num_data_points:
+            # The first block is generated straight into the output, its valid rows are then moved to the front
+            candidates = self.generate_candidates(block_size, bound, rng, sampler, dtype,
+                                                  out=data_points if num_candidates == 0 else None)
+            with metrics.stage('validation'):
+                mask = self.get_valid_mask(candidates)
+                num_block_valid = int(np.count_nonzero(mask))
+                num_accepted = min(num_block_valid, num_data_points - num_valid)
+                if num_block_valid < block_size or candidates is not data_points:
+                    for i in range(candidates.shape[1]):
+                        data_points[num_valid:num_valid + num_accepted, i] = candidates[mask, i][:num_accepted]
+            num_valid += num_accepted
+            num_found += num_block_valid
+            num_candidates += block_size
+            metrics.increment('rows_sampled', block_size)
+            metrics.increment('rows_rejected', block_size - num_block_valid)
+
+            acceptance_rate = num_found / num_candidates
+            if num_candidates >= MIN_CANDIDATES_FOR_ACCEPTANCE and acceptance_rate < min_acceptance_rate:
+                raise ValueError(f"Only {acceptance_rate:.2%} of the sampled rows of {self.name} are valid, "
+                                 f"check the domains of its variables")
+
+            # Draw enough candidates to fill the remaining rows at the observed acceptance rate
+            missing = num_data_points - num_valid
+            if acceptance_rate > 0:
+                block_size = min(int(np.ceil(missing / acceptance_rate * 1.1)), max(num_data_points,
+                                                                                     MIN_CANDIDATES_FOR_ACCEPTANCE))
+            else:
+                block_size = max(missing, MIN_CANDIDATES_FOR_ACCEPTANCE - num_candidates)
+
+        metrics.increment('rows_generated', num_data_points)
+        return data_points
+
+    def generate_random_data_point(self, bound=10000, rng=None):
+        return self.generate_random_data_points(1, bound, rng)[0].tolist()
+
+    def calculate_discrepancy(self, data_points, bound=10000, sampler=None):
+        # Coverage of the independent variables, measured in the space the sampler draws from
+        sampler = sampler or default_sampler
+        unit_points = np.column_stack([sampler.to_unit(var.domain, data_points[:, i + 1], bound)
+                                       for i, var in enumerate(self.independent_variables)])
+        return calculate_discrepancy(unit_points)
 
     def get_variable_symbol_with_units(self):
         result = [f"{self.dependent_variable.symbol} ({self.dependent_variable.unit})"]
         for var in self.independent_variables:
             result.append(f"{var.symbol} ({var.unit})")
         return result
-
@@ -0,0 +1,140 @@
+import ast
+
+import numpy as np
+
+from src.util.constant_handler import ConstantHandler
+
+
+class RegressedModel:
+    # Functions a regressed model may call, mapped to their vectorized numpy versions
+    functions = {
+        'sin': np.sin,
+        'cos': np.cos,
+        'tan': np.tan,
+        'asin': np.arcsin,
+        'acos': np.arccos,
+        'atan': np.arctan,
+        'arcsin': np.arcsin,
+        'arccos': np.arccos,
+        'arctan': np.arctan,
+        'sinh': np.sinh,
+        'cosh': np.cosh,
+        'tanh': np.tanh,
+        'exp': np.exp,
+        'log': np.log,
+        'ln': np.log,
+        'log10': np.log10,
+        'log2': np.log2,
+        'sqrt': np.sqrt,
+        'abs': np.abs,
+        'Abs': np.abs,
+    }
+
+    binary_operators = {
+        ast.Add: np.add,
+        ast.Sub: np.subtract,
+        ast.Mult: np.multiply,
+        ast.Div: np.true_divide,
+        ast.Pow: np.power,
+    }
+
+    unary_operators = {
+        ast.UAdd: np.positive,
+        ast.USub: np.negative,
+    }
+
+    def __init__(self, expression, variable_symbols):
+        self.expression = expression
+        self.variable_symbols = list(variable_symbols)
+
+        # Parse the expression once, then check every node so evaluating it can never run arbitrary code
+        try:
+            self.tree = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(f"Invalid model expression '{expression}': {e.msg}")
+        # Resolve the constants once, variables shadow constants with the same symbol
+        self.constants = ConstantHandler.get_constant_bindings(expression, self.variable_symbols)
+        self.validate(self.tree)
+
+    def __repr__(self):
+        return f"RegressedModel(expression={self.expression}, variable_symbols={self.variable_symbols})"
+
+    @staticmethod
+    def clean_expression(expression):
+        expression = expression.replace('^', '**')
+
+        if '=' in expression:
+            expression = expression.split('=')[1]
+
+        if '≈' in expression:
+            expression = expression.split('≈')[1]
+
+        return expression
+
+    def validate(self, node):
+        if isinstance(node, ast.BinOp):
+            if type(node.op) not in self.binary_operators:
+                raise ValueError(f"Unsupported operator in model: {type(node.op).__name__}")
+            self.validate(node.left)
+            self.validate(node.right)
+
+        elif isinstance(node, ast.UnaryOp):
+            if type(node.op) not in self.unary_operators:
+                raise ValueError(f"Unsupported operator in model: {type(node.op).__name__}")
+            self.validate(node.operand)
+
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in self.functions:
+                raise ValueError(f"Unsupported function in model: {ast.unparse(node.func)}")
+            if len(node.args) != 1 or node.keywords:
+                raise ValueError(f"Function {node.func.id} takes exactly one argument")
+            self.validate(node.args[0])
+
+        elif isinstance(node, ast.Name):
+            # Variables shadow constants with the same symbol
+            if node.id not in self.variable_symbols and node.id not in self.constants:
+                raise ValueError(f"Unknown symbol in model: {node.id}")
+
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ValueError(f"Unsupported constant in model: {node.value!r}")
+            # Integer literals are evaluated as float64, so one that does not fit is rejected here
+            try:
+                np.float64(node.value)
+            except OverflowError:
+                raise ValueError("Numeric literal out of range in model")
+
+        else:
+            raise ValueError(f"Unsupported expression in model: {ast.unparse(node)}")
+
+    def get_used_symbols(self):
+        return sorted({node.id for node in ast.walk(self.tree)
+                       if isinstance(node, ast.Name) and node.id in self.variable_symbols})
+
+    def evaluate(self, columns):
+        # columns maps every variable symbol to a column of values, the whole column is evaluated at once
+        columns = {symbol: np.asarray(column, dtype=np.float64) for symbol, column in columns.items()}
+        missing = [symbol for symbol in self.get_used_symbols() if symbol not in columns]
+        if missing:
+            raise ValueError(f"Missing values for model symbols: {', '.join(missing)}")
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = self.evaluate_node(self.tree, columns)
+
+        # A model without variables evaluates to a scalar, so broadcast it to the length of the columns
+        shape = np.broadcast_shapes(*(column.shape for column in columns.values())) if columns else ()
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), shape).copy()
+
+    def evaluate_node(self, node, columns):
+        if isinstance(node, ast.BinOp):
+            return self.binary_operators[type(node.op)](self.evaluate_node(node.left, columns),
+                                                        self.evaluate_node(node.right, columns))
+        if isinstance(node, ast.UnaryOp):
+            return self.unary_operators[type(node.op)](self.evaluate_node(node.operand, columns))
+        if isinstance(node, ast.Call):
+            return self.functions[node.func.id](self.evaluate_node(node.args[0], columns))
+        if isinstance(node, ast.Name):
+            if node.id in self.variable_symbols:
+                return columns[node.id]
+            return np.float64(self.constants[node.id])
+        return np.float64(node.value)
@@ -23,4 +23,6 @@ if __name__ == "__main__":
 
     # Create a formula loader
     formula_loader = FormulaLoader(file_name)
-    formula_loader.add_formula(capacitance_formula)
+    formula_loader.add_formulas([capacitance_formula])
+    # Merge the journal of added formulas back into the formula file
+    formula_loader.compact()
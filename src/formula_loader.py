@@ -1,4 +1,6 @@
 import json
+import os
+
 from src.entity.formula import Formula
 from src.entity.variable import Variable
 
@@ -7,58 +9,106 @@ class FormulaEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, Variable):
             return o.to_dict()
+        if isinstance(o, Formula):
+            return o.to_dict()
         return super().default(o)
 
 
 class FormulaLoader:
+    # New formulas are appended to a JSON lines journal next to the formula file, which is merged back into
+    # the formula file by compact() once it holds more than this many formulas
+    JOURNAL_COMPACT_THRESHOLD = 1000
+
     def __init__(self, formula_file):
         self.formula_file = formula_file
+        self.journal_file = formula_file + '.journal'
+        self.formulas = []
+        # Indexes for constant time lookups by name, by file name and by (name, equation)
+        self.formulas_by_name = {}
+        self.formulas_by_underlined_name = {}
+        self.formula_keys = set()
+        self.journal_size = 0
         self.formulas = self.load_formulas()
 
     def load_formulas(self):
+        self.formulas = []
+        self.formulas_by_name = {}
+        self.formulas_by_underlined_name = {}
+        self.formula_keys = set()
+
+        # The variables of every formula are only deserialized when they are first used
+        for data in self.read_formula_file():
+            self.index_formula(Formula.from_dict(data))
+
+        # Replay the formulas added since the last compaction
+        journal_data = self.read_journal()
+        self.journal_size = len(journal_data)
+        for data in journal_data:
+            self.index_formula(Formula.from_dict(data))
+
+        return self.formulas
+
+    def read_formula_file(self):
         try:
             with open(self.formula_file, 'r') as file:
-                formulas_data = json.load(file)
-                formulas = []
-                for data in formulas_data:
-                    name = data['name']
-                    equation = data['equation']
-                    independent_variables_data = data['independent_variables']
-                    dependent_variable_data = data['dependent_variable']
-
-                    independent_variables = [Variable.from_dict(v_data) for v_data in independent_variables_data]
-                    dependent_variable = Variable.from_dict(dependent_variable_data)
-
-                    formula = Formula(name, equation, independent_variables, dependent_variable)
-                    formulas.append(formula)
-                return formulas
+                content = file.read()
         except FileNotFoundError:
             return []
+        # An empty file is an empty formula list
+        return json.loads(content) if content.strip() else []
+
+    def read_journal(self):
+        try:
+            with open(self.journal_file, 'r') as file:
+                return [json.loads(line) for line in file if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def index_formula(self, formula):
+        # prevent duplicate formulas
+        if formula.get_key() in self.formula_keys:
+            return False
+        self.formulas.append(formula)
+        self.formula_keys.add(formula.get_key())
+        self.formulas_by_name.setdefault(formula.name, formula)
+        self.formulas_by_underlined_name.setdefault(formula.get_name_with_underline(), formula)
+        return True
 
     def save_formulas(self):
-        formulas_data = []
-        for formula in self.formulas:
-            formula_data = {
-                'name': formula.name,
-                'equation': formula.equation,
-                'independent_variables': formula.independent_variables,
-                'dependent_variable': formula.dependent_variable
-            }
-            formulas_data.append(formula_data)
-        with open(self.formula_file, 'w') as file:
-            json.dump(formulas_data, file, indent=4, cls=FormulaEncoder)
-
-    # prevent duplicate formulas
+        # Rewrite the whole formula file atomically and drop the journal it now contains
+        temp_file = self.formula_file + '.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump(self.formulas, file, indent=4, cls=FormulaEncoder)
+        os.replace(temp_file, self.formula_file)
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.journal_size = 0
+
+    def compact(self):
+        self.save_formulas()
+
     def add_formula(self, formula):
-        if formula not in self.formulas:
-            self.formulas.append(formula)
-            self.save_formulas()
+        return self.add_formulas([formula]) == 1
+
+    def add_formulas(self, formulas):
+        added = [formula for formula in formulas if self.index_formula(formula)]
+        if not added:
+            return 0
+
+        # Only the new formulas are written, in a single append to the journal
+        with open(self.journal_file, 'a') as file:
+            file.write(''.join(json.dumps(formula, cls=FormulaEncoder) + '\n' for formula in added))
+        self.journal_size += len(added)
+
+        if self.journal_size > self.JOURNAL_COMPACT_THRESHOLD:
+            self.compact()
+        return len(added)
 
     def get_formula(self, name):
-        for formula in self.formulas:
-            if formula.name == name:
-                return formula
-        return None
+        return self.formulas_by_name.get(name)
+
+    def get_formula_by_underlined_name(self, underlined_name):
+        return self.formulas_by_underlined_name.get(underlined_name)
 
     def list_formulas(self):
         return self.formulas
@@ -0,0 +1,531 @@
+import argparse
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+import numpy as np
+
+from src.formula_loader import FormulaLoader
+from src.util import metrics
+from src.util.backends import AUTO_BACKEND, BACKEND_ENVIRONMENT_VARIABLE, BACKENDS, validate_backend, \
+    validate_default_backend
+from src.util.columnar_store import COLUMNAR_EXTENSION, DTYPES, ColumnarDataset, ColumnarWriter, \
+    allocate_columns, append_columnar, compact_columnar, is_columnar_path
+from src.util.dataset_store import DatasetStore, get_dataset_columns
+from src.util.external_sort import DEFAULT_MEMORY_BUDGET, external_sort
+from src.util.sampling import AUTO_LOG_DECADES, SAMPLING_METHODS, SCALES, Sampler
+from src.util.sharding import get_shards, get_worker_count, map_in_order
+from src.util.splitting import DEFAULT_TESTING_RATIO, SPLIT_RULES, Splitter
+
+# This module is the headless generation core, it must never import Qt or matplotlib
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+FORMULA_FILE = os.path.join(DATA_DIR, 'formulae', 'formulae.json')
+SPLITS = ('training', 'testing')
+DEFAULT_CHUNK_SIZE = 1_000_000
+# Output formats and the extension of their files, columnar datasets are folders of .npy files
+FILE_EXTENSIONS = {'csv': '.csv', 'columnar': COLUMNAR_EXTENSION}
+FORMATS = tuple(FILE_EXTENSIONS)
+
+
+def find_formula(formula_loader, formula_name):
+    # Accept both the display name and the underlined name used for the data files
+    formula = formula_loader.get_formula(formula_name) or formula_loader.get_formula_by_underlined_name(formula_name)
+    if formula is None:
+        raise ValueError(f"Unknown formula: {formula_name}")
+    return formula
+
+
+def get_output_path(formula, split='training', data_dir=DATA_DIR, file_format='csv'):
+    if split not in SPLITS:
+        raise ValueError(f"Split must be one of {', '.join(SPLITS)}, got: {split}")
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}, got: {file_format}")
+    return os.path.join(data_dir, f'{split}_data', formula.get_name_with_underline() + FILE_EXTENSIONS[file_format])
+
+
+def sort_data_points(data_points):
+    # sort the data points by the dependent variable in the first column, one column at a time so the sorted
+    # copy keeps the layout of the data points
+    with metrics.stage('sorting'):
+        order = np.argsort(data_points[:, 0], kind='stable')
+        sorted_points = np.empty_like(data_points)
+        for i in range(data_points.shape[1]):
+            np.take(data_points[:, i], order, out=sorted_points[:, i])
+        return sorted_points
+
+
+def concatenate_columns(chunks, num_columns, dtype=np.float64):
+    # Copy the chunks into a single buffer in which every column is contiguous
+    data_points = allocate_columns(sum(len(chunk) for chunk in chunks), num_columns, dtype)
+    start = 0
+    for chunk in chunks:
+        data_points[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return data_points
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+def generate_data_frame(formula, num_data_points, inf_boundary=10000, seed=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                        workers=1, progress_callback=None, is_cancelled=None, sampler=None, dtype=np.float64):
+    import pandas as pd
+
+    # Cancellation is checked between chunks, nothing has been written when GenerationCancelled is raised.
+    # The chunks are copied into one preallocated buffer as they arrive, the data frame wraps its sorted copy.
+    columns = formula.get_variable_symbol_with_units()
+    data_points = allocate_columns(num_data_points, len(columns), dtype)
+    generated = 0
+    for chunk in generate_chunks(formula, num_data_points, inf_boundary, seed, chunk_size, workers, sampler, dtype):
+        if is_cancelled is not None and is_cancelled():
+            raise GenerationCancelled()
+        data_points[generated:generated + len(chunk)] = chunk
+        generated += len(chunk)
+        if progress_callback is not None:
+            progress_callback(generated, num_data_points)
+
+    return pd.DataFrame(sort_data_points(data_points), columns=columns, copy=False)
+
+
+def get_splitter(formula, testing_ratio=DEFAULT_TESTING_RATIO, split_rule='random', seed=None,
+                 held_out_variable=None, inf_boundary=10000, sampler=None):
+    # The routing has its own random stream, so it does not change the generated rows
+    split_seed = None if seed is None else [seed, 1]
+    get_held_out_position = None
+    if split_rule == 'held-out':
+        symbols = [var.symbol for var in formula.independent_variables]
+        held_out_variable = held_out_variable or symbols[0]
+        if held_out_variable not in symbols:
+            raise ValueError(f"Held-out variable must be one of {', '.join(symbols)}, got: {held_out_variable}")
+        column = symbols.index(held_out_variable) + 1
+        domain = formula.independent_variables[column - 1].domain
+        sampler = sampler or Sampler()
+
+        def get_held_out_position(data_points):
+            return sampler.to_unit(domain, data_points[:, column], inf_boundary)
+
+    return Splitter(testing_ratio, split_rule, split_seed, get_held_out_position)
+
+
+def generate_split_data_frames(formula, num_data_points, splitter, inf_boundary=10000, seed=None,
+                               chunk_size=DEFAULT_CHUNK_SIZE, workers=1, progress_callback=None, is_cancelled=None,
+                               sampler=None, dtype=np.float64):
+    import pandas as pd
+
+    # The rows are sampled and evaluated once, then every chunk is routed to the training or testing split
+    parts = {split: [] for split in SPLITS}
+    generated = 0
+    for chunk in generate_chunks(formula, num_data_points, inf_boundary, seed, chunk_size, workers, sampler, dtype):
+        if is_cancelled is not None and is_cancelled():
+            raise GenerationCancelled()
+        with metrics.stage('splitting'):
+            for split, data_points in splitter.split(chunk).items():
+                parts[split].append(data_points)
+        generated += len(chunk)
+        if progress_callback is not None:
+            progress_callback(generated, num_data_points)
+
+    columns = formula.get_variable_symbol_with_units()
+    return {split: pd.DataFrame(sort_data_points(concatenate_columns(parts[split], len(columns), dtype)),
+                                columns=columns, copy=False)
+            for split in SPLITS}
+
+
+def save_data_points(data_frame, file_name, is_sorted=False):
+    # Append the new data points as a sorted segment, only the new rows are written. The data frames of
+    # generate_data_frame are already sorted, so they are not sorted again.
+    if is_columnar_path(file_name):
+        data_points = data_frame.to_numpy()
+        return append_columnar(file_name, data_points, data_frame.columns.tolist(), data_points.dtype, is_sorted)
+    return DatasetStore(file_name).append(data_frame, is_sorted)
+
+
+def compact_data_points(file_name):
+    # Merge all the appended segments into the sorted csv file or columnar dataset
+    if is_columnar_path(file_name):
+        return compact_columnar(file_name)
+    return DatasetStore(file_name).compact()
+
+
+def generate_shard(formula, size, inf_boundary, seed_sequence, sampler=None, dtype=np.float64):
+    # The metrics of the shard are returned with its rows, so shards run in worker processes are counted too
+    with metrics.use_metrics(metrics.RunMetrics()) as shard_metrics:
+        data_points = formula.generate_random_data_points(size, inf_boundary, np.random.default_rng(seed_sequence),
+                                                          sampler=sampler, dtype=dtype)
+    return data_points, shard_metrics.snapshot()
+
+
+def generate_chunks(formula, num_data_points, inf_boundary=10000, seed=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    workers=1, sampler=None, dtype=np.float64):
+    # Every chunk is a shard with its own random stream, so a seed reproduces the same rows for the same
+    # chunk size no matter how many worker processes generate them
+    tasks = ((formula, size, inf_boundary, seed_sequence, sampler, dtype)
+             for size, seed_sequence in get_shards(num_data_points, chunk_size, seed))
+    for data_points, shard_metrics in map_in_order(generate_shard, tasks, workers):
+        metrics.get_metrics().merge(shard_metrics)
+        yield data_points
+
+
+def write_shard(formula, size, inf_boundary, seed_sequence, part_file, sampler=None, dtype=np.float64):
+    import pandas as pd
+
+    data_points, shard_metrics = generate_shard(formula, size, inf_boundary, seed_sequence, sampler, dtype)
+    start_time = time.perf_counter()
+    pd.DataFrame(data_points, copy=False).to_csv(part_file, header=False, index=False)
+    shard_metrics['stages']['writing'] = {'seconds': time.perf_counter() - start_time, 'calls': 1}
+    return part_file, size, shard_metrics
+
+
+def write_shards_in_parallel(formula, file_name, num_data_points, inf_boundary=10000, seed=None,
+                             chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, workers=None, sampler=None,
+                             dtype=np.float64):
+    # Each worker generates and formats its own shard into a part file, the part files are then
+    # stitched into the output in shard order as soon as they are finished. The output is only replaced
+    # once every shard has been stitched into a temporary file.
+    if os.path.dirname(file_name) and not os.path.exists(os.path.dirname(file_name)):
+        os.makedirs(os.path.dirname(file_name))
+
+    part_prefix = file_name + '.part'
+    temp_file = file_name + '.tmp'
+    tasks = ((formula, size, inf_boundary, seed_sequence, f'{part_prefix}{i:06d}', sampler, dtype)
+             for i, (size, seed_sequence) in enumerate(get_shards(num_data_points, chunk_size, seed)))
+    rows_written = 0
+    try:
+        with open(temp_file, 'w', newline='') as file:
+            file.write(','.join(formula.get_variable_symbol_with_units()) + '\n')
+            for part_file, size, shard_metrics in map_in_order(write_shard, tasks, workers):
+                metrics.get_metrics().merge(shard_metrics)
+                with metrics.stage('stitching'), open(part_file, 'r', newline='') as part:
+                    shutil.copyfileobj(part, file)
+                os.remove(part_file)
+                rows_written += size
+                if progress_callback is not None:
+                    progress_callback(rows_written, num_data_points)
+            metrics.increment('bytes_written', file.tell())
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+    os.replace(temp_file, file_name)
+    return rows_written
+
+
+class CsvChunkWriter:
+    # Writes the header, then the rows of every chunk, with the same interface as ColumnarWriter.
+    # The rows go to a temporary file that only replaces the output once the writer is closed.
+    def __init__(self, file_name, columns, dtype=np.float64):
+        self.file_name = file_name
+        self.columns = list(columns)
+        # float32 values are written with the shortest text that reads back as the same float32
+        self.dtype = np.dtype(dtype)
+        self.temp_file = file_name + '.tmp'
+        self.file = open(self.temp_file, 'w', newline='')
+        # Write the header even when there are no rows
+        self.file.write(','.join(self.columns) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data_points):
+        import pandas as pd
+
+        data_points = np.asarray(data_points, dtype=self.dtype)
+        pd.DataFrame(data_points, columns=self.columns, copy=False).to_csv(self.file, header=False, index=False)
+
+    def close(self):
+        if not self.file.closed:
+            metrics.increment('bytes_written', self.file.tell())
+            self.file.close()
+            os.replace(self.temp_file, self.file_name)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+
+def open_chunk_writer(file_name, columns, dtype=np.float64):
+    # Check if the folder exists, if not create it
+    if os.path.dirname(file_name) and not os.path.exists(os.path.dirname(file_name)):
+        os.makedirs(os.path.dirname(file_name))
+    if is_columnar_path(file_name):
+        return ColumnarWriter(file_name, columns, dtype)
+    return CsvChunkWriter(file_name, columns, dtype)
+
+
+def write_chunks(chunks, file_name, columns, num_data_points=None, progress_callback=None, dtype=np.float64):
+    rows_written = 0
+    with open_chunk_writer(file_name, columns, dtype) as writer:
+        for chunk in chunks:
+            with metrics.stage('writing'):
+                writer.write(chunk)
+            rows_written += len(chunk)
+            if progress_callback is not None:
+                progress_callback(rows_written, num_data_points)
+
+    return rows_written
+
+
+def write_split_chunks(chunks, splitter, file_names, columns, num_data_points=None, progress_callback=None,
+                       dtype=np.float64):
+    # Both splits are written at the same time, every chunk is formatted by one writer thread per split
+    rows_written = {split: 0 for split in file_names}
+    with ExitStack() as stack, ThreadPoolExecutor(max_workers=len(file_names)) as executor:
+        writers = {split: stack.enter_context(open_chunk_writer(file_name, columns, dtype))
+                   for split, file_name in file_names.items()}
+
+        generated = 0
+        for chunk in chunks:
+            with metrics.stage('splitting'):
+                parts = splitter.split(chunk)
+            with metrics.stage('writing'):
+                futures = [executor.submit(writers[split].write, parts[split]) for split in writers]
+                for future in futures:
+                    future.result()
+            for split in writers:
+                rows_written[split] += len(parts[split])
+            generated += len(chunk)
+            if progress_callback is not None:
+                progress_callback(generated, num_data_points)
+
+    return rows_written
+
+
+def stream_split_data_points(formula, file_names, num_data_points, splitter, inf_boundary=10000, seed=None,
+                             chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, sort=False,
+                             memory_budget=DEFAULT_MEMORY_BUDGET, workers=1, sampler=None, dtype=np.float64):
+    chunks = generate_chunks(formula, num_data_points, inf_boundary, seed, chunk_size, workers, sampler, dtype)
+    rows_written = write_split_chunks(chunks, splitter, file_names, formula.get_variable_symbol_with_units(),
+                                      num_data_points, progress_callback, dtype)
+    # The streamed files replace the whole datasets, the segments appended earlier are dropped once they are in place
+    for file_name in file_names.values():
+        DatasetStore(file_name).clear_segments()
+    if sort:
+        for file_name in file_names.values():
+            sort_data_file(file_name, memory_budget=memory_budget, chunk_size=chunk_size)
+    return rows_written
+
+
+def stream_data_points(formula, file_name, num_data_points, inf_boundary=10000, seed=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, sort=False,
+                       memory_budget=DEFAULT_MEMORY_BUDGET, workers=1, sampler=None, dtype=np.float64):
+    # Unsorted shards are formatted into csv part files by the workers themselves
+    if not sort and get_worker_count(workers) > 1 and not is_columnar_path(file_name):
+        rows_written = write_shards_in_parallel(formula, file_name, num_data_points, inf_boundary, seed, chunk_size,
+                                                progress_callback, workers, sampler, dtype)
+    else:
+        # Only a few chunks are held in memory at a time, the rows are written in generation order unless sorted
+        chunks = generate_chunks(formula, num_data_points, inf_boundary, seed, chunk_size, workers, sampler, dtype)
+        if sort:
+            chunks = external_sort(chunks, memory_budget, os.path.dirname(os.path.abspath(file_name)))
+        rows_written = write_chunks(chunks, file_name, formula.get_variable_symbol_with_units(), num_data_points,
+                                    progress_callback, dtype)
+
+    # The streamed file replaces the whole dataset, the segments appended earlier are dropped once it is in place
+    DatasetStore(file_name).clear_segments()
+    return rows_written
+
+
+def read_chunks(file_name, chunk_size=DEFAULT_CHUNK_SIZE):
+    # The rows of a csv file or a columnar dataset as numpy arrays of at most chunk_size rows
+    if is_columnar_path(file_name):
+        yield from ColumnarDataset(file_name).iter_chunks(chunk_size)
+        return
+
+    import pandas as pd
+
+    with pd.read_csv(file_name, chunksize=chunk_size, dtype=np.float64, float_precision='round_trip') as reader:
+        for data_frame in reader:
+            yield data_frame.to_numpy()
+
+
+def sort_data_file(file_name, output_file=None, memory_budget=DEFAULT_MEMORY_BUDGET, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Sort a data file that may not fit in memory on its first column, in place by default.
+    # The input is read completely into sorted runs before the first row is written.
+    output_file = output_file or file_name
+    columns = get_dataset_columns(file_name)
+    # csv files are read as float64, columnar datasets keep their data type
+    dtype = ColumnarDataset(file_name).dtype if is_columnar_path(file_name) else np.float64
+    # The writers replace the output atomically once every row has been written
+    chunks = read_chunks(file_name, chunk_size)
+    write_chunks(external_sort(chunks, memory_budget, os.path.dirname(os.path.abspath(output_file))), output_file,
+                 columns, dtype=dtype)
+    return output_file
+
+
+def generate_data(formula_name, num_data_points, inf_boundary=10000, split='training', seed=None,
+                  output_path=None, formula_file=FORMULA_FILE, stream=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                  progress_callback=None, compact=False, sort=False, memory_budget=DEFAULT_MEMORY_BUDGET,
+                  workers=1, sampler=None, file_format='csv', backend=None, dtype=np.float64):
+    formula = find_formula(FormulaLoader(formula_file), formula_name)
+    if backend is not None:
+        formula.backend = validate_backend(backend)
+    if output_path is None:
+        output_path = get_output_path(formula, split, file_format=file_format)
+    elif split not in SPLITS:
+        raise ValueError(f"Split must be one of {', '.join(SPLITS)}, got: {split}")
+
+    if stream:
+        stream_data_points(formula, output_path, num_data_points, inf_boundary, seed, chunk_size, progress_callback,
+                           sort, memory_budget, workers, sampler, dtype)
+    else:
+        data_frame = generate_data_frame(formula, num_data_points, inf_boundary, seed, chunk_size, workers,
+                                         sampler=sampler, dtype=dtype)
+        save_data_points(data_frame, output_path, is_sorted=True)
+    if compact:
+        compact_data_points(output_path)
+    return output_path
+
+
+def generate_split_data(formula_name, num_data_points, testing_ratio=DEFAULT_TESTING_RATIO, split_rule='random',
+                        held_out_variable=None, inf_boundary=10000, seed=None, output_paths=None,
+                        formula_file=FORMULA_FILE, stream=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                        progress_callback=None, compact=False, sort=False, memory_budget=DEFAULT_MEMORY_BUDGET,
+                        workers=1, sampler=None, file_format='csv', backend=None, dtype=np.float64):
+    # Generate the training and testing data of a formula in a single pass, the rows are split by testing_ratio
+    formula = find_formula(FormulaLoader(formula_file), formula_name)
+    if backend is not None:
+        formula.backend = validate_backend(backend)
+    output_paths = {split: (output_paths or {}).get(split) or get_output_path(formula, split, file_format=file_format)
+                    for split in SPLITS}
+    splitter = get_splitter(formula, testing_ratio, split_rule, seed, held_out_variable, inf_boundary, sampler)
+
+    if stream:
+        stream_split_data_points(formula, output_paths, num_data_points, splitter, inf_boundary, seed, chunk_size,
+                                 progress_callback, sort, memory_budget, workers, sampler, dtype)
+    else:
+        data_frames = generate_split_data_frames(formula, num_data_points, splitter, inf_boundary, seed, chunk_size,
+                                                 workers, sampler=sampler, dtype=dtype)
+        for split, data_frame in data_frames.items():
+            save_data_points(data_frame, output_paths[split], is_sorted=True)
+    if compact:
+        for output_path in output_paths.values():
+            compact_data_points(output_path)
+    return output_paths
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Generate random data points for a physics formula.')
+    parser.add_argument('formula', help='formula name, e.g. "I.25.13: Capacitance" or I.25.13_Capacitance')
+    parser.add_argument('-n', '--num-data-points', type=int, required=True, help='number of data points')
+    parser.add_argument('--inf-boundary', type=float, default=10000, help='boundary value used for infinity')
+    parser.add_argument('--split', choices=SPLITS, default='training', help='generate training or testing data')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible data')
+    parser.add_argument('-o', '--output', default=None,
+                        help='output csv file or columnar dataset (.cols), defaults to data/<split>_data/')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='format of the default output files, columnar writes one .npy file per column')
+    parser.add_argument('--formula-file', default=FORMULA_FILE, help='formula json file')
+    parser.add_argument('--testing-ratio', type=float, default=None,
+                        help='generate both splits in one pass, this fraction of the rows goes to the testing data '
+                             '(-o is then the training output)')
+    parser.add_argument('--testing-output', default=None,
+                        help='testing output csv file with --testing-ratio, defaults to data/testing_data/')
+    parser.add_argument('--split-rule', choices=SPLIT_RULES, default='random',
+                        help='route rows at random, stratified on the dependent variable, or hold out the top of '
+                             'a variable range for extrapolation tests')
+    parser.add_argument('--held-out-variable', default=None,
+                        help='variable whose range is held out with --split-rule held-out, defaults to the first')
+    parser.add_argument('--stream', action='store_true',
+                        help='write fixed-size chunks straight to a new output file instead of appending and sorting')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows per chunk in stream mode')
+    parser.add_argument('--sort', action='store_true',
+                        help='sort the streamed rows on the first column with an out-of-core merge sort')
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help='memory budget of the sort in MB')
+    parser.add_argument('--sampling', choices=SAMPLING_METHODS, default='uniform',
+                        help='sampling method, the quasi-random sequences cover the domain with fewer rows')
+    parser.add_argument('--scale', choices=SCALES, default='linear',
+                        help='sample non-negative ranges log-uniformly, auto does so for ranges spanning '
+                             f'{AUTO_LOG_DECADES} or more decades')
+    parser.add_argument('--dtype', choices=DTYPES, default='float64',
+                        help='data type of the generated values, float32 halves the memory use and output size')
+    parser.add_argument('--backend', choices=(AUTO_BACKEND,) + BACKENDS, default=None,
+                        help='evaluate the formula with numpy, numexpr or numba, auto picks one from the size of the '
+                             f'formula and of every chunk (defaults to ${BACKEND_ENVIRONMENT_VARIABLE} or auto)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 uses one per cpu (results do not depend on it)')
+    parser.add_argument('--metrics-report', default=None,
+                        help='write stage durations, rows, bytes written and peak memory to this json file')
+    parser.add_argument('--prometheus-textfile', default=None,
+                        help='write the run metrics to this file for the node exporter textfile collector')
+    parser.add_argument('--profile', default=None,
+                        help=f'comma separated profilers to enable ({", ".join(metrics.PROFILERS)}), '
+                             f'defaults to ${metrics.PROFILE_ENVIRONMENT_VARIABLE}')
+    parser.add_argument('--compact', action='store_true',
+                        help='merge the appended segments into the sorted csv file or columnar dataset after '
+                             'generating')
+    arguments = parser.parse_args(argv)
+    if arguments.num_data_points < 1:
+        parser.error('--num-data-points must be at least 1')
+    if arguments.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    if arguments.workers < 0:
+        parser.error('--workers must not be negative')
+    if arguments.memory_budget < 1:
+        parser.error('--memory-budget must be at least 1')
+    if arguments.testing_ratio is not None and not 0 < arguments.testing_ratio < 1:
+        parser.error('--testing-ratio must be between 0 and 1')
+    try:
+        metrics.get_enabled_profilers(arguments.profile)
+        if arguments.backend is None:
+            validate_default_backend()
+    except ValueError as e:
+        parser.error(str(e))
+    return arguments
+
+
+def print_progress(rows_written, num_data_points):
+    print(f"Written {rows_written}/{num_data_points} data points", file=sys.stderr)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    run_metrics = metrics.get_metrics()
+    # Profiles are written next to the metrics report, or to the working directory
+    profile_prefix = os.path.splitext(arguments.metrics_report or 'generate')[0]
+    sampler = Sampler(arguments.sampling, arguments.scale)
+    with metrics.profile(arguments.profile, profile_prefix), run_metrics.stage('total'):
+        if arguments.testing_ratio is not None:
+            output_paths = generate_split_data(arguments.formula, arguments.num_data_points, arguments.testing_ratio,
+                                               arguments.split_rule, arguments.held_out_variable,
+                                               arguments.inf_boundary, arguments.seed,
+                                               {'training': arguments.output, 'testing': arguments.testing_output},
+                                               arguments.formula_file, arguments.stream, arguments.chunk_size,
+                                               print_progress, arguments.compact, arguments.sort,
+                                               arguments.memory_budget * 1024 * 1024, arguments.workers, sampler,
+                                               arguments.format, arguments.backend, arguments.dtype)
+            output_path = ' and '.join(output_paths.values())
+        else:
+            output_path = generate_data(arguments.formula, arguments.num_data_points, arguments.inf_boundary,
+                                        arguments.split, arguments.seed, arguments.output, arguments.formula_file,
+                                        arguments.stream, arguments.chunk_size, print_progress, arguments.compact,
+                                        arguments.sort, arguments.memory_budget * 1024 * 1024, arguments.workers,
+                                        sampler, arguments.format, arguments.backend, arguments.dtype)
+
+    if arguments.metrics_report is not None:
+        run_metrics.write_report(arguments.metrics_report)
+    if arguments.prometheus_textfile is not None:
+        run_metrics.write_prometheus_textfile(arguments.prometheus_textfile,
+                                              {'formula': arguments.formula,
+                                               'split': arguments.split if arguments.testing_ratio is None else 'both'})
+    print(f"Generated {arguments.num_data_points} data points for {arguments.formula} in {output_path}")
+    report = run_metrics.get_report()
+    if report['counters'].get('rows_rejected'):
+        print(f"Rejected {report['counters']['rows_rejected']} invalid rows, "
+              f"acceptance rate {report['acceptance_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,80 @@
-import os
 import sys
+import threading
+import time
 
-import pandas as pd
+from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QLabel, QComboBox, QWidget, QDesktopWidget, \
-    QSpinBox, QPushButton
+    QSpinBox, QPushButton, QProgressBar, QHBoxLayout
 from src.formula_loader import FormulaLoader
+from src.generate import GenerationCancelled, generate_data_frame, generate_split_data_frames, get_splitter, \
+    sort_data_points, save_data_points
+from src.util.splitting import DEFAULT_TESTING_RATIO
+
+# Largest number of data points that can be generated from the window, and rows generated between progress updates
+MAX_DATA_POINTS = 10_000_000
+PROGRESS_CHUNK_SIZE = 100_000
+
+
+class GenerationWorker(QThread):
+    # Generates and saves the data points off the main thread, so the window stays responsive
+    progress = pyqtSignal(int, int)
+    throughput = pyqtSignal(float)
+    completed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, formula, num_data_points, inf_boundary, file_name, parent=None, testing_file_name=None):
+        super().__init__(parent)
+        self.formula = formula
+        self.num_data_points = num_data_points
+        self.inf_boundary = inf_boundary
+        self.file_name = file_name
+        # With a testing file the rows are split between the training and testing data in a single pass
+        self.testing_file_name = testing_file_name
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        start_time = time.perf_counter()
+
+        def report_progress(generated, num_data_points):
+            self.progress.emit(generated, num_data_points)
+            elapsed = time.perf_counter() - start_time
+            if elapsed > 0:
+                self.throughput.emit(generated / elapsed)
+
+        try:
+            if self.testing_file_name is not None:
+                splitter = get_splitter(self.formula, DEFAULT_TESTING_RATIO, inf_boundary=self.inf_boundary)
+                data_frames = generate_split_data_frames(self.formula, self.num_data_points, splitter,
+                                                         self.inf_boundary, chunk_size=PROGRESS_CHUNK_SIZE,
+                                                         progress_callback=report_progress,
+                                                         is_cancelled=self.cancel_event.is_set)
+            else:
+                data_frames = {'training': generate_data_frame(self.formula, self.num_data_points, self.inf_boundary,
+                                                               chunk_size=PROGRESS_CHUNK_SIZE,
+                                                               progress_callback=report_progress,
+                                                               is_cancelled=self.cancel_event.is_set)}
+            # Last chance to cancel, the data files are written atomically after this point
+            if self.cancel_event.is_set():
+                raise GenerationCancelled()
+            save_data_points(data_frames['training'], self.file_name, is_sorted=True)
+            if self.testing_file_name is not None:
+                save_data_points(data_frames['testing'], self.testing_file_name, is_sorted=True)
+        except GenerationCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+
+        if self.testing_file_name is not None:
+            self.completed.emit(f"{self.file_name} and {self.testing_file_name}")
+        else:
+            self.completed.emit(self.file_name)
 
 
 class PhysicsDataGenerator(QMainWindow):
@@ -14,7 +83,7 @@ class PhysicsDataGenerator(QMainWindow):
 
         # Load formulas using FormulaLoader
         formula_loader = FormulaLoader('../data/formulae/formulae.json')
-        self.formulas = formula_loader.load_formulas()
+        self.formulas = formula_loader.list_formulas()
 
         # Set up the main window
         self.setWindowTitle('Physics Data Generator')
@@ -50,7 +119,8 @@ class PhysicsDataGenerator(QMainWindow):
 
         self.data_points_spinbox = QSpinBox()
         self.data_points_spinbox.setMinimum(1)
-        self.data_points_spinbox.setMaximum(10000)
+        self.data_points_spinbox.setMaximum(MAX_DATA_POINTS)
+        self.data_points_spinbox.setGroupSeparatorShown(True)
         layout.addWidget(self.data_points_spinbox)
 
         # Create a QLabel and QSpinBox to select the boundary value for infinity (inf option)
@@ -66,12 +136,30 @@ class PhysicsDataGenerator(QMainWindow):
         self.training_or_testing = QComboBox()
         self.training_or_testing.addItem("Training")
         self.training_or_testing.addItem("Testing")
+        self.training_or_testing.addItem(f"Training + Testing ({DEFAULT_TESTING_RATIO:.0%} testing)")
         layout.addWidget(self.training_or_testing)
 
-        # Create a QPushButton to initiate data generation
-        generate_button = QPushButton('Generate Data')
-        generate_button.clicked.connect(self.generate_data_points)
-        layout.addWidget(generate_button)
+        # Create a QPushButton to initiate data generation and one to cancel it
+        buttons_layout = QHBoxLayout()
+        self.generate_button = QPushButton('Generate Data')
+        self.generate_button.clicked.connect(self.generate_data_points)
+        buttons_layout.addWidget(self.generate_button)
+
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_generation)
+        buttons_layout.addWidget(self.cancel_button)
+        layout.addLayout(buttons_layout)
+
+        # Create a progress bar and a label for the progress and throughput of the generation
+        self.progress_bar = QProgressBar()
+        layout.addWidget(self.progress_bar)
+
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        # The worker thread of the generation in progress
+        self.generation_worker = None
 
         # Create a central widget and set the layout
         central_widget = QWidget()
@@ -113,6 +201,10 @@ class PhysicsDataGenerator(QMainWindow):
             self.selected_formula_label.setText(f"{self.selected_formula_label.text()}\n{variable_info}")
 
     def generate_data_points(self):
+        # Only one generation runs at a time
+        if self.generation_worker is not None:
+            return
+
         selected_formula_index = self.formula_dropdown.currentIndex()
         if 0 <= selected_formula_index < len(self.formulas):
             selected_formula = self.formulas[selected_formula_index]
@@ -121,16 +213,60 @@ class PhysicsDataGenerator(QMainWindow):
             print(f"Generating {num_data_points} data points for formula: {selected_formula.name}")
             print(f"Boundary value for infinity: {inf_boundary}")
 
-            generated_data_points = []
-            # Add your data generation logic here
-            for _ in range(num_data_points):
-                generated_data_points.append(selected_formula.generate_random_data_point(inf_boundary))
-            generated_data_points = self.sort_data_points(generated_data_points)
-            variable_info = selected_formula.get_variable_symbol_with_units()
-            data_frame = pd.DataFrame(generated_data_points, columns=variable_info)
-
-            # Save the data points to a csv file
-            self.save_data_points(data_frame, selected_formula.get_name_with_underline(), self.is_training())
+            # Sample, evaluate, sort and save the data points on a worker thread
+            formula_name = selected_formula.get_name_with_underline()
+            file_name = self.get_file_name(formula_name, self.is_training() or self.is_both_splits())
+            testing_file_name = self.get_file_name(formula_name, False) if self.is_both_splits() else None
+            self.generation_worker = GenerationWorker(selected_formula, num_data_points, inf_boundary, file_name,
+                                                      self, testing_file_name)
+            self.generation_worker.progress.connect(self.on_generation_progress)
+            self.generation_worker.throughput.connect(self.on_generation_throughput)
+            self.generation_worker.completed.connect(self.on_generation_completed)
+            self.generation_worker.cancelled.connect(self.on_generation_cancelled)
+            self.generation_worker.failed.connect(self.on_generation_failed)
+            self.generation_worker.finished.connect(self.on_generation_finished)
+
+            self.progress_bar.setValue(0)
+            self.status_label.setText('Generating...')
+            self.generate_button.setEnabled(False)
+            self.cancel_button.setEnabled(True)
+            self.generation_worker.start()
+
+    def cancel_generation(self):
+        if self.generation_worker is not None:
+            self.generation_worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText('Cancelling...')
+
+    def on_generation_progress(self, generated, num_data_points):
+        self.progress_bar.setValue(int(100 * generated / num_data_points))
+
+    def on_generation_throughput(self, rows_per_second):
+        self.status_label.setText(f"Generating... {rows_per_second:,.0f} rows/s")
+
+    def on_generation_completed(self, file_name):
+        self.progress_bar.setValue(100)
+        self.status_label.setText(f"Saved to {file_name}")
+
+    def on_generation_cancelled(self):
+        self.progress_bar.setValue(0)
+        self.status_label.setText('Generation cancelled, nothing was saved')
+
+    def on_generation_failed(self, message):
+        self.status_label.setText(f"Generation failed: {message}")
+
+    def on_generation_finished(self):
+        self.generation_worker.deleteLater()
+        self.generation_worker = None
+        self.generate_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        # Stop a running generation cleanly before the window goes away
+        if self.generation_worker is not None:
+            self.generation_worker.cancel()
+            self.generation_worker.wait()
+        super().closeEvent(event)
 
     def is_training(self):
         if self.training_or_testing.currentText() == "Training":
@@ -138,34 +274,21 @@ class PhysicsDataGenerator(QMainWindow):
         else:
             return False
 
+    def is_both_splits(self):
+        # The last item generates the training and testing data in one pass
+        return self.training_or_testing.currentIndex() == 2
+
     def sort_data_points(self, generated_data):
-        # sort the data points by the independent variable
-        sorted_data_points = sorted(generated_data, key=lambda x: x[0])
-        return sorted_data_points
+        return sort_data_points(generated_data)
 
-    def save_data_points(self, data_frame, formula_name, is_training_data=True):
+    def get_file_name(self, formula_name, is_training_data=True):
         if is_training_data:
-            file_name = '../data/training_data/' + formula_name + '.csv'
+            return '../data/training_data/' + formula_name + '.csv'
         else:
-            file_name = '../data/testing_data/' + formula_name + '.csv'
+            return '../data/testing_data/' + formula_name + '.csv'
 
-        # Check if the folder exists, if not create it
-        if not os.path.exists(os.path.dirname(file_name)):
-            os.makedirs(os.path.dirname(file_name))
-
-        # Check if the file exists and contains data before reading
-        if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
-            existing_data_points = pd.read_csv(file_name)
-        else:
-            # If the file does not exist or is empty, create an empty DataFrame
-            existing_data_points = pd.DataFrame()
-
-        # append the new data points to the existing data points
-        data_frame = pd.concat([existing_data_points, data_frame])
-        # sort the data points by the independent variable
-        data_frame = data_frame.sort_values(by=data_frame.columns[0])
-        # save the data points to a csv file
-        data_frame.to_csv(file_name, index=False)
+    def save_data_points(self, data_frame, formula_name, is_training_data=True):
+        save_data_points(data_frame, self.get_file_name(formula_name, is_training_data))
 
 
 if __name__ == "__main__":
@@ -1,29 +1,178 @@
+import argparse
 import os
-import csv
-import matplotlib.pyplot as plt
-
-def plot_graph_from_csv(csv_file_path):
-    x_values = []
-    y_values = []
-
-    with open(csv_file_path, mode='r') as file:
-        csv_reader = csv.reader(file)
-        next(csv_reader)  # Skip the header row
-        for row in csv_reader:
-            x_values.append(float(row[0]))
-            y_values.append(float(row[1]))
-
-    plt.plot(x_values, y_values, 'bo-', label='Generated Data')
-    plt.xlabel('x')
-    plt.ylabel('y')
-    plt.title('Generated Data Plot')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
 
-if __name__ == "__main__":
-    data_file_path = os.path.join("../data", "generated_data.csv")
-    if os.path.exists(data_file_path):
-        plot_graph_from_csv(data_file_path)
+import numpy as np
+
+from src.util.columnar_store import ColumnarDataset, is_columnar_path
+from src.util.dataset_store import DatasetStore
+from src.util.downsampling import lttb, min_max_downsample, quantile_sketch
+
+# Above this many points the plots are drawn from aggregated data instead of every single point
+MAX_RAW_POINTS = 50000
+MAX_LINE_POINTS = 5000
+DENSITY_GRID_SIZE = 200
+QQ_QUANTILES = 1000
+
+
+def get_pyplot(headless=False):
+    import matplotlib
+
+    # The Agg backend renders to files and does not need a display
+    if headless:
+        matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    return plt
+
+
+def read_xy_from_csv(csv_file_path, chunk_size=1_000_000):
+    # Only the first two columns are parsed, in chunks of numpy arrays, including the pending segments
+    store = DatasetStore(csv_file_path)
+    x_chunks = []
+    y_chunks = []
+    columns = None
+    for data_frame in store.iter_chunks(chunk_size, usecols=[0, 1]):
+        x_chunks.append(data_frame.iloc[:, 0].to_numpy(dtype=np.float64))
+        y_chunks.append(data_frame.iloc[:, 1].to_numpy(dtype=np.float64))
+        columns = data_frame.columns
+    if not x_chunks:
+        columns = store.get_columns()
+        if columns is None:
+            raise FileNotFoundError(f"No data file found at {csv_file_path}")
+        return np.empty(0), np.empty(0), columns[0], columns[1]
+    return np.concatenate(x_chunks), np.concatenate(y_chunks), columns[0], columns[1]
+
+
+def read_xy_from_columnar(dataset_path):
+    # The columns are memory-mapped, nothing is parsed or copied until segments are appended
+    dataset = ColumnarDataset(dataset_path)
+    columns = dataset.get_columns()
+    return dataset.get_column(0), dataset.get_column(1), columns[0], columns[1]
+
+
+def draw_line(axes, x_values, y_values, mode='lttb', max_points=MAX_LINE_POINTS, **kwargs):
+    # Downsample before drawing so the time to draw does not grow with the number of points
+    if len(x_values) > max_points:
+        if mode == 'minmax':
+            x_values, y_values = min_max_downsample(x_values, y_values, max_points // 2)
+        else:
+            x_values, y_values = lttb(x_values, y_values, max_points)
+    axes.plot(x_values, y_values, **kwargs)
+
+
+def draw_density(axes, x_values, y_values, grid_size=DENSITY_GRID_SIZE):
+    # Aggregate the points into hexagonal bins and colour them by count
+    finite = np.isfinite(x_values) & np.isfinite(y_values)
+    image = axes.hexbin(x_values[finite], y_values[finite], gridsize=grid_size, bins='log', mincnt=1, cmap='Blues')
+    axes.figure.colorbar(image, ax=axes, label='Points (log)')
+
+
+def draw_qq_sketch(axes, values, num_quantiles=QQ_QUANTILES):
+    from scipy.stats import norm
+
+    # Compare a fixed number of sample quantiles with the normal quantiles, with a standardized reference line
+    probabilities, sample_quantiles = quantile_sketch(values, num_quantiles)
+    theoretical_quantiles = norm.ppf(probabilities)
+    finite_values = np.asarray(values)[np.isfinite(values)]
+    axes.plot(theoretical_quantiles, sample_quantiles, 'bo', markersize=3)
+    axes.plot(theoretical_quantiles, np.mean(finite_values) + np.std(finite_values) * theoretical_quantiles, 'r-')
+
+
+def finish_plot(plt, output_file=None):
+    plt.tight_layout()
+    if output_file is None:
+        plt.show()
+    else:
+        plt.savefig(output_file)
+        plt.close()
+
+
+def plot_graph_from_csv(data_file_path, mode='auto', output_file=None, max_points=MAX_LINE_POINTS):
+    plt = get_pyplot(output_file is not None)
+    if is_columnar_path(data_file_path):
+        x_values, y_values, x_label, y_label = read_xy_from_columnar(data_file_path)
+    else:
+        x_values, y_values, x_label, y_label = read_xy_from_csv(data_file_path)
+
+    # Small data sets are drawn point by point as before, large ones are aggregated first
+    if mode == 'auto':
+        mode = 'raw' if len(x_values) <= MAX_RAW_POINTS else 'density'
+
+    figure, axes = plt.subplots(figsize=(8, 6))
+    if mode == 'raw':
+        axes.plot(x_values, y_values, 'bo-', label='Generated Data')
+    elif mode in ('lttb', 'minmax'):
+        draw_line(axes, x_values, y_values, mode, max_points, color='blue', label='Generated Data')
+    elif mode == 'density':
+        draw_density(axes, x_values, y_values)
+    else:
+        raise ValueError(f"Unknown plot mode: {mode}")
+
+    axes.set_xlabel(x_label)
+    axes.set_ylabel(y_label)
+    axes.set_title('Generated Data Plot')
+    if mode != 'density':
+        axes.legend()
+    axes.grid(True)
+    finish_plot(plt, output_file)
+
+
+def plot_residual_diagnostics(residuals, fitted_result, output_prefix=None):
+    plt = get_pyplot(output_prefix is not None)
+    residuals = np.asarray(residuals, dtype=np.float64)
+    fitted_result = np.asarray(fitted_result, dtype=np.float64)
+
+    # Residuals vs. Fitted Values Plot
+    figure, axes = plt.subplots(figsize=(8, 6))
+    if len(residuals) <= MAX_RAW_POINTS:
+        axes.scatter(fitted_result, residuals, c='blue', marker='o', edgecolors='black')
     else:
-        print("The data file does not exist. Please generate the data points first.")
+        draw_density(axes, fitted_result, residuals)
+    axes.axhline(y=0, color='red', linestyle='--')
+    axes.set_xlabel('Fitted Values')
+    axes.set_ylabel('Residuals')
+    axes.set_title('Residuals vs. Fitted Values Plot')
+    finish_plot(plt, None if output_prefix is None else output_prefix + '_residuals.png')
+
+    # Normal Q-Q Plot
+    if len(residuals) <= MAX_RAW_POINTS:
+        import statsmodels.api as sm
+        sm.qqplot(residuals, line='s')
+    else:
+        figure, axes = plt.subplots(figsize=(8, 6))
+        draw_qq_sketch(axes, residuals)
+    plt.xlabel('Theoretical Quantiles')
+    plt.ylabel('Standardized Residuals')
+    plt.title('Normal Q-Q Plot of Residuals')
+    finish_plot(plt, None if output_prefix is None else output_prefix + '_qq.png')
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Plot generated data files.')
+    parser.add_argument('files', nargs='*', default=[os.path.join("../data", "generated_data.csv")],
+                        help='csv files or columnar datasets (.cols) to plot')
+    parser.add_argument('--mode', choices=('auto', 'raw', 'lttb', 'minmax', 'density'), default='auto',
+                        help='how to draw the points, auto aggregates large files')
+    parser.add_argument('--max-points', type=int, default=MAX_LINE_POINTS, help='points kept by lttb and minmax')
+    parser.add_argument('--output-dir', default=None,
+                        help='write one png per file to this folder without opening a window')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.output_dir is not None and not os.path.exists(arguments.output_dir):
+        os.makedirs(arguments.output_dir)
+
+    for data_file_path in arguments.files:
+        if not os.path.exists(data_file_path):
+            print(f"The data file {data_file_path} does not exist. Please generate the data points first.")
+            continue
+        output_file = None
+        if arguments.output_dir is not None:
+            file_name = os.path.splitext(os.path.basename(data_file_path))[0] + '.png'
+            output_file = os.path.join(arguments.output_dir, file_name)
+        plot_graph_from_csv(data_file_path, arguments.mode, output_file, arguments.max_points)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import time budget in milliseconds of every entry point, and the heavy packages it must not import at startup
+ENTRY_POINTS = {
+    'src.generate': {'budget_ms': 400, 'forbidden': ['PyQt5', 'matplotlib', 'statsmodels', 'sympy', 'pandas']},
+    'src.batch_verifier': {'budget_ms': 400, 'forbidden': ['PyQt5', 'matplotlib', 'statsmodels', 'sympy', 'pandas']},
+    'src.plotter': {'budget_ms': 300, 'forbidden': ['PyQt5', 'matplotlib', 'statsmodels', 'sympy', 'pandas']},
+    'src.generator': {'budget_ms': 600, 'forbidden': ['matplotlib', 'statsmodels', 'sympy', 'pandas']},
+    'src.verifier': {'budget_ms': 600, 'forbidden': ['matplotlib', 'statsmodels', 'sympy', 'pandas']},
+}
+
+
+def parse_importtime(output):
+    # Lines look like "import time: self [us] | cumulative | imported package", nesting is shown by indentation
+    cumulative_us = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        cumulative_us[package.strip()] = int(cumulative)
+    return cumulative_us
+
+
+def measure_entry_point(module, repeat=3):
+    # Every measurement runs in a fresh interpreter, the fastest of the runs is reported
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    best_ms = None
+    loaded_modules = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=PROJECT_DIR,
+                                 capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=PROJECT_DIR))
+        if process.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{process.stderr.strip().splitlines()[-1]}")
+        import_ms = parse_importtime(process.stderr).get(module, 0) / 1000
+        best_ms = import_ms if best_ms is None else min(best_ms, import_ms)
+        loaded_modules = json.loads(process.stdout)
+    return best_ms, loaded_modules
+
+
+def run_benchmark(entry_points=None, repeat=3, budget_scale=1.0):
+    results = []
+    for module, settings in (entry_points or ENTRY_POINTS).items():
+        result = {'module': module, 'budget_ms': settings['budget_ms'] * budget_scale, 'import_ms': None,
+                  'forbidden_imports': [], 'error': '', 'passed': False}
+        try:
+            result['import_ms'], loaded_modules = measure_entry_point(module, repeat)
+        except RuntimeError as e:
+            result['error'] = str(e)
+            results.append(result)
+            continue
+
+        loaded_packages = {name.split('.')[0] for name in loaded_modules}
+        result['forbidden_imports'] = [package for package in settings['forbidden'] if package in loaded_packages]
+        result['passed'] = result['import_ms'] <= result['budget_ms'] and not result['forbidden_imports']
+        results.append(result)
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the import time of every entry point against a budget.')
+    parser.add_argument('modules', nargs='*', help='entry points to measure, defaults to all of them')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per entry point')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='multiply every budget, e.g. on slow machines')
+    parser.add_argument('-o', '--output', default=None, help='write the results to this json file')
+    arguments = parser.parse_args(argv)
+    unknown = [module for module in arguments.modules if module not in ENTRY_POINTS]
+    if unknown:
+        parser.error(f"unknown entry points: {', '.join(unknown)}")
+    return arguments
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    entry_points = {module: ENTRY_POINTS[module] for module in arguments.modules} or ENTRY_POINTS
+    results = run_benchmark(entry_points, arguments.repeat, arguments.budget_scale)
+
+    for result in results:
+        status = 'ok' if result['passed'] else 'FAILED'
+        if result['error']:
+            print(f"{result['module']:<20} {status}: {result['error']}")
+            continue
+        print(f"{result['module']:<20} {result['import_ms']:8.1f} ms / {result['budget_ms']:.0f} ms  {status}")
+        if result['forbidden_imports']:
+            print(f"{'':<20} imports {', '.join(result['forbidden_imports'])} at startup")
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=4)
+
+    if not all(result['passed'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import ast
+import functools
+import importlib.util
+import os
+
+# numpy evaluates every operator into a temporary array on one core, numexpr evaluates the expression in
+# cache-sized blocks on several threads and numba compiles it to a ufunc. numexpr and numba are optional.
+BACKENDS = ('numpy', 'numexpr', 'numba')
+AUTO_BACKEND = 'auto'
+BACKEND_ENVIRONMENT_VARIABLE = 'PHYSICS_DATA_GENERATOR_BACKEND'
+BACKEND_MODULES = {'numpy': 'numpy', 'numexpr': 'numexpr', 'numba': 'numba'}
+# Smaller batches or expressions are evaluated with numpy, the other backends only pay off above these sizes.
+# The rows are those of a single evaluation, at most one chunk (1 000 000 rows by default) when generating.
+NUMEXPR_MIN_ROWS = 100_000
+NUMEXPR_MIN_OPERATIONS = 3
+JIT_MIN_ROWS = 1_000_000
+JIT_MIN_OPERATIONS = 10
+# Operations every backend rounds correctly, so they all give bit-identical results. A square is a single
+# multiplication in all of them. Equations with any other operation, such as exp, log or cubes, are evaluated
+# with numpy whatever backend is selected.
+EXACT_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.UAdd, ast.USub)
+EXACT_FUNCTIONS = ('sqrt', 'abs', 'Abs')
+EXACT_POWERS = (2,)
+
+
+def validate_backend(backend):
+    if backend != AUTO_BACKEND and backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {', '.join((AUTO_BACKEND,) + BACKENDS)}, got: {backend}")
+    return backend
+
+
+def validate_default_backend():
+    # Called by the command line tools, so a mistyped environment variable is reported instead of ignored
+    return validate_backend(os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, AUTO_BACKEND))
+
+
+def get_default_backend():
+    # An invalid environment variable falls back to numpy, it must not stop formulas from being created
+    backend = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, AUTO_BACKEND)
+    return backend if backend == AUTO_BACKEND or backend in BACKENDS else 'numpy'
+
+
+@functools.lru_cache(maxsize=None)
+def is_backend_available(backend):
+    # Checked without importing the backend
+    return importlib.util.find_spec(BACKEND_MODULES[backend]) is not None
+
+
+@functools.lru_cache(maxsize=4096)
+def get_operation_count(equation):
+    # Operators and function calls of the equation, a cheap measure of its size that does not need sympy
+    try:
+        tree = ast.parse(equation.replace('^', '**'), mode='eval')
+    except SyntaxError:
+        return len(equation)
+    return sum(isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call)) for node in ast.walk(tree))
+
+
+@functools.lru_cache(maxsize=4096)
+def is_exactly_rounded(equation):
+    # Checked on the equation text without sympy, kernel_cache checks the parsed expression again
+    try:
+        tree = ast.parse(equation.replace('^', '**'), mode='eval')
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            if not isinstance(node.right, ast.Constant) or node.right.value not in EXACT_POWERS:
+                return False
+        elif isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            if not isinstance(node.op, EXACT_OPERATORS):
+                return False
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in EXACT_FUNCTIONS or node.keywords:
+                return False
+        elif not isinstance(node, (ast.Expression, ast.Name, ast.Constant, ast.Load, ast.operator, ast.unaryop)):
+            return False
+    return True
+
+
+def choose_backend(equation, num_rows):
+    operation_count = get_operation_count(equation)
+    if num_rows >= JIT_MIN_ROWS and operation_count >= JIT_MIN_OPERATIONS and is_backend_available('numba'):
+        return 'numba'
+    if num_rows >= NUMEXPR_MIN_ROWS and operation_count >= NUMEXPR_MIN_OPERATIONS and \
+            is_backend_available('numexpr'):
+        return 'numexpr'
+    return 'numpy'
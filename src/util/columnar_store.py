@@ -0,0 +1,273 @@
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from src.util import metrics
+
+# A columnar dataset is a folder with one .npy file per column and a small json header with the column names,
+# symbols and units. The columns are memory-mapped when read, so slices of them are never copied.
+# Rows appended later are kept as sorted segments, columnar datasets of their own in subfolders listed in the header,
+# until they are compacted into the dataset.
+COLUMNAR_EXTENSION = '.cols'
+HEADER_FILE = 'header.json'
+FORMAT_VERSION = 2
+READABLE_FORMAT_VERSIONS = (1, 2)
+# A dataset that is being replaced is moved here first, so a crash always leaves one of the two versions behind
+REPLACED_SUFFIX = '.old'
+# Version 1.0 .npy files with a fixed-size header, so the row count can be written once all the rows are
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_HEADER_SIZE = 128
+# Data types of the generated values, float32 halves the memory and size of data sets that do not need float64
+DTYPES = ('float64', 'float32')
+
+
+def is_columnar_path(file_name):
+    return file_name.rstrip('/\\').endswith(COLUMNAR_EXTENSION)
+
+
+def get_columnar_path(file_name):
+    return os.path.splitext(file_name)[0] + COLUMNAR_EXTENSION
+
+
+def parse_column_name(column_name):
+    # Columns are named "symbol (unit)", see Formula.get_variable_symbol_with_units
+    symbol, _, unit = column_name.partition(' ')
+    return symbol, unit.strip().removeprefix('(').removesuffix(')')
+
+
+def allocate_columns(num_rows, num_columns, dtype=np.float64):
+    # A (num_rows, num_columns) array in which every column is contiguous, so columns are filled, evaluated and
+    # written without copies
+    return np.empty((num_columns, num_rows), dtype=dtype).T
+
+
+def write_header(path, header):
+    # Write to a temporary file first so an interrupted write never corrupts the header
+    header_file = os.path.join(path, HEADER_FILE)
+    with open(header_file + '.tmp', 'w') as file:
+        json.dump(header, file, indent=4)
+    os.replace(header_file + '.tmp', header_file)
+
+
+def restore_replaced_directory(path):
+    # Move back the dataset a crash left aside, before it is written to or replaced
+    replaced_dir = path + REPLACED_SUFFIX
+    if not os.path.exists(path) and os.path.exists(replaced_dir):
+        os.replace(replaced_dir, path)
+
+
+def replace_directory(temp_dir, path):
+    # The old dataset is renamed aside before the new one takes its place and only deleted afterwards
+    restore_replaced_directory(path)
+    replaced_dir = path + REPLACED_SUFFIX
+    if os.path.exists(path):
+        if os.path.exists(replaced_dir):
+            shutil.rmtree(replaced_dir)
+        os.replace(path, replaced_dir)
+    os.replace(temp_dir, path)
+    if os.path.exists(replaced_dir):
+        shutil.rmtree(replaced_dir)
+
+
+def write_npy_header(file, dtype, num_rows):
+    header = repr({'descr': np.dtype(dtype).str, 'fortran_order': False, 'shape': (num_rows,)})
+    header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 3) + '\n'
+    file.write(NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
+class ColumnarWriter:
+    # Streams rows into a new columnar dataset, the dataset only replaces the output once it is closed
+    def __init__(self, path, columns, dtype=np.float64):
+        self.path = path.rstrip('/\\')
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self.temp_dir = self.path + '.tmp'
+        self.num_rows = 0
+
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+        os.makedirs(self.temp_dir)
+        self.column_files = [f'column_{i:03d}.npy' for i in range(len(self.columns))]
+        self.files = [open(os.path.join(self.temp_dir, column_file), 'wb') for column_file in self.column_files]
+        for file in self.files:
+            write_npy_header(file, self.dtype, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data_points):
+        data_points = np.asarray(data_points)
+        if data_points.ndim != 2 or data_points.shape[1] != len(self.columns):
+            raise ValueError(f"Expected rows of {len(self.columns)} columns, got an array of shape "
+                             f"{data_points.shape}")
+        for i, file in enumerate(self.files):
+            file.write(memoryview(np.ascontiguousarray(data_points[:, i], dtype=self.dtype)))
+        self.num_rows += len(data_points)
+
+    def close(self):
+        for file in self.files:
+            file.seek(0)
+            write_npy_header(file, self.dtype, self.num_rows)
+            file.close()
+
+        columns = []
+        for column_name, column_file in zip(self.columns, self.column_files):
+            symbol, unit = parse_column_name(column_name)
+            columns.append({'name': column_name, 'symbol': symbol, 'unit': unit, 'file': column_file})
+        write_header(self.temp_dir, {'format_version': FORMAT_VERSION, 'rows': self.num_rows, 'dtype': self.dtype.str,
+                                     'columns': columns, 'segments': [], 'next_segment_id': 0})
+
+        replace_directory(self.temp_dir, self.path)
+        metrics.increment('bytes_written', len(self.files) * (NPY_HEADER_SIZE + self.num_rows * self.dtype.itemsize))
+        return self.num_rows
+
+    def abort(self):
+        for file in self.files:
+            file.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class ColumnarDataset:
+    def __init__(self, path):
+        self.path = path.rstrip('/\\')
+        # A writer interrupted while replacing the dataset leaves the previous version aside
+        if not os.path.exists(self.path) and os.path.exists(self.path + REPLACED_SUFFIX):
+            self.path += REPLACED_SUFFIX
+        with open(os.path.join(self.path, HEADER_FILE), 'r') as file:
+            self.header = json.load(file)
+        if self.header.get('format_version') not in READABLE_FORMAT_VERSIONS:
+            raise ValueError(f"Unsupported columnar dataset version: {self.header.get('format_version')}")
+        self.header.setdefault('segments', [])
+        self.header.setdefault('next_segment_id', 0)
+        self.segments = [ColumnarDataset(os.path.join(self.path, segment['dir']))
+                         for segment in self.header['segments']]
+        self.num_rows = self.header['rows'] + sum(len(segment) for segment in self.segments)
+        self.dtype = np.dtype(self.header['dtype'])
+
+    def __len__(self):
+        return self.num_rows
+
+    def get_columns(self):
+        return [column['name'] for column in self.header['columns']]
+
+    def get_symbols(self):
+        return [column['symbol'] for column in self.header['columns']]
+
+    def get_parts(self):
+        # The compacted rows first, then every segment in the order it was appended
+        return [self] + self.segments
+
+    def map_column(self, index):
+        # A read-only memory map of the compacted rows only, an empty column cannot be mapped
+        file_name = os.path.join(self.path, self.header['columns'][index]['file'])
+        with metrics.stage('loading'):
+            return np.load(file_name, mmap_mode='r' if self.header['rows'] else None)
+
+    def get_column(self, index):
+        # Memory-mapped while there are no segments, the segments are concatenated in a copy otherwise
+        columns = [part.map_column(index) for part in self.get_parts()]
+        if len(columns) == 1:
+            return columns[0]
+        with metrics.stage('loading'):
+            return np.concatenate(columns)
+
+    def load_columns(self):
+        # Same layout as split_columns: the dependent column, then the independent columns keyed by their symbol
+        symbols = self.get_symbols()
+        return self.get_column(0), {symbol: self.get_column(i) for i, symbol in enumerate(symbols) if i > 0}
+
+    def iter_column_chunks(self, chunk_size):
+        # Slices of the memory-mapped columns, only the pages that are read are loaded from disk
+        symbols = self.get_symbols()
+        for part in self.get_parts():
+            columns = [part.map_column(i) for i in range(len(symbols))]
+            for start in range(0, part.header['rows'], chunk_size):
+                yield (columns[0][start:start + chunk_size],
+                       {symbol: column[start:start + chunk_size] for symbol, column in zip(symbols[1:], columns[1:])})
+
+    def iter_chunks(self, chunk_size):
+        # Row-major copies of the rows, for writers that need whole rows
+        for part in self.get_parts():
+            columns = [part.map_column(i) for i in range(len(self.header['columns']))]
+            for start in range(0, part.header['rows'], chunk_size):
+                yield np.column_stack([column[start:start + chunk_size] for column in columns])
+
+
+def write_columnar(path, data_points, columns, dtype=np.float64):
+    with ColumnarWriter(path, columns, dtype) as writer:
+        writer.write(data_points)
+    return path
+
+
+def append_columnar(path, data_points, columns, dtype=np.float64, is_sorted=False):
+    # Only the new rows are written, sorted on the dependent variable, as a segment of an existing dataset.
+    # The first batch of a new dataset is already compacted.
+    data_points = np.asarray(data_points)
+    if not is_sorted:
+        with metrics.stage('sorting'):
+            data_points = data_points[np.argsort(data_points[:, 0], kind='stable')]
+    path = path.rstrip('/\\')
+    restore_replaced_directory(path)
+    if not os.path.exists(os.path.join(path, HEADER_FILE)):
+        return write_columnar(path, data_points, columns, dtype)
+
+    dataset = ColumnarDataset(path)
+    if dataset.get_columns() != list(columns):
+        raise ValueError(f"Columns {list(columns)} do not match the dataset columns {dataset.get_columns()}")
+    segment_dir = f"segment_{dataset.header['next_segment_id']:06d}"
+    write_columnar(os.path.join(dataset.path, segment_dir), data_points, columns, dataset.dtype)
+    # The segment only becomes part of the dataset once the header lists it
+    dataset.header['segments'].append({'dir': segment_dir, 'rows': len(data_points)})
+    dataset.header['next_segment_id'] += 1
+    write_header(dataset.path, dataset.header)
+    return os.path.join(dataset.path, segment_dir)
+
+
+def compact_columnar(path, memory_budget=None, chunk_size=1_000_000):
+    # Merge the segments into the dataset with an out-of-core sort, every part is already sorted and the stable
+    # sort keeps rows with equal keys in the order they were appended
+    from src.util.external_sort import DEFAULT_MEMORY_BUDGET, external_sort
+
+    dataset = ColumnarDataset(path)
+    if not dataset.segments:
+        return path
+    with metrics.stage('compaction'):
+        chunks = external_sort(dataset.iter_chunks(chunk_size), memory_budget or DEFAULT_MEMORY_BUDGET,
+                               os.path.dirname(os.path.abspath(dataset.path)))
+        with ColumnarWriter(path, dataset.get_columns(), dataset.dtype) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    return path
+
+
+def csv_to_columnar(csv_file, path, chunk_size=1_000_000, dtype=np.float64):
+    import pandas as pd
+
+    columns = pd.read_csv(csv_file, nrows=0).columns.tolist()
+    with ColumnarWriter(path, columns, dtype) as writer, \
+            pd.read_csv(csv_file, chunksize=chunk_size, dtype=np.float64, float_precision='round_trip') as reader:
+        for data_frame in reader:
+            writer.write(data_frame.to_numpy())
+    return path
+
+
+def columnar_to_csv(path, csv_file, chunk_size=1_000_000):
+    import pandas as pd
+
+    dataset = ColumnarDataset(path)
+    temp_file = csv_file + '.tmp'
+    with open(temp_file, 'w', newline='') as file:
+        file.write(','.join(dataset.get_columns()) + '\n')
+        for data_points in dataset.iter_chunks(chunk_size):
+            pd.DataFrame(data_points).to_csv(file, header=False, index=False)
+    os.replace(temp_file, csv_file)
+    return csv_file
@@ -1,3 +1,4 @@
+import functools
 import math
 import re
 
@@ -15,27 +16,71 @@ class ConstantHandler:
         'R': 8.314462618,  # Ideal gas constant (J/mol/K)
     }
 
+    # CODATA 2018 values that can be added to the constants with register_constants(ConstantHandler.codata_constants)
+    codata_constants = {
+        'hbar': 1.054571817e-34,  # Reduced Planck constant (J*s)
+        'q_e': 1.602176634e-19,  # Elementary charge (C)
+        'm_e': 9.1093837015e-31,  # Electron mass (kg)
+        'm_p': 1.67262192369e-27,  # Proton mass (kg)
+        'epsilon_0': 8.8541878128e-12,  # Vacuum electric permittivity (F/m)
+        'mu_0': 1.25663706212e-6,  # Vacuum magnetic permeability (N/A^2)
+        'k_e': 8.9875517923e9,  # Coulomb constant (N*m^2/C^2)
+        'sigma_sb': 5.670374419e-8,  # Stefan-Boltzmann constant (W/m^2/K^4)
+        'g_n': 9.80665,  # Standard acceleration of gravity (m/s^2)
+    }
+
+    # Matches every identifier that is not part of a longer identifier or of a number such as 1e5
+    identifier_pattern = re.compile(r"(?<![a-zA-Z0-9_.])[a-zA-Z_][a-zA-Z0-9_]*")
+
     @staticmethod
     def handle_constant_in_equation(equation):
-        for constant in ConstantHandler.get_constants_in_equation(equation):
-            equation = ConstantHandler.replace_constant_in_equation(equation, constant)
-        return equation
+        constants_in_equation = set(ConstantHandler.get_constants_in_equation(equation))
+        if not constants_in_equation:
+            return equation
+        # Replace all the constants in a single pass, repr keeps the full float precision
+        return ConstantHandler.identifier_pattern.sub(
+            lambda match: repr(ConstantHandler.get_constant_value(match.group()))
+            if match.group() in constants_in_equation else match.group(), equation)
 
     @staticmethod
     def get_constants_in_equation(equation):
-        return [constant for constant in ConstantHandler.constants.keys() if
-                ConstantHandler.is_constant_in_equation(equation, constant)]
+        identifiers = ConstantHandler.get_identifiers(equation)
+        return [constant for constant in ConstantHandler.constants.keys() if constant in identifiers]
 
     @staticmethod
     def is_constant_in_equation(equation, constant):
-        pattern = r"(?<![a-zA-Z0-9_])" + re.escape(constant) + r"(?![a-zA-Z0-9_])"
-        return bool(re.search(pattern, equation))
+        return constant in ConstantHandler.get_identifiers(equation)
 
     @staticmethod
     def replace_constant_in_equation(equation, constant):
-        pattern = r"(?<![a-zA-Z0-9_])" + re.escape(constant) + r"(?![a-zA-Z0-9_])"
-        return re.sub(pattern, str(ConstantHandler.get_constant_value(constant)), equation)
+        return ConstantHandler.identifier_pattern.sub(
+            lambda match: repr(ConstantHandler.get_constant_value(constant)) if match.group() == constant
+            else match.group(), equation)
 
     @staticmethod
     def get_constant_value(constant):
         return ConstantHandler.constants.get(constant, None)
+
+    @staticmethod
+    def get_constant_bindings(equation, variable_symbols=()):
+        # The constants an equation uses and their values, variables shadow constants with the same symbol
+        return {constant: float(ConstantHandler.constants[constant])
+                for constant in ConstantHandler.get_constants_in_equation(equation)
+                if constant not in variable_symbols}
+
+    @staticmethod
+    def register_constant(name, value):
+        if not re.fullmatch(r"[a-zA-Z_][a-zA-Z0-9_]*", name):
+            raise ValueError(f"Invalid constant name: {name}")
+        ConstantHandler.constants[name] = value
+
+    @staticmethod
+    def register_constants(constants):
+        for name, value in constants.items():
+            ConstantHandler.register_constant(name, value)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def get_identifiers(equation):
+        # Tokenize every equation once, constants are then found with set lookups
+        return frozenset(ConstantHandler.identifier_pattern.findall(equation))
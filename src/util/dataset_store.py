@@ -0,0 +1,230 @@
+import heapq
+import json
+import os
+
+import numpy as np
+
+from src.util import metrics
+from src.util.columnar_store import HEADER_FILE, ColumnarDataset, get_columnar_path, is_columnar_path
+
+
+class DatasetStore:
+    # A dataset is a compacted csv file plus sorted segment files appended next to it. Appending only writes
+    # the new rows, compact() merges all the segments into the csv file in one streaming pass, or sorts them
+    # together out of core when the csv file is not sorted.
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.segment_dir = file_name + '.segments'
+        self.manifest_file = os.path.join(self.segment_dir, self.MANIFEST_FILE)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'columns': None, 'segments': [], 'next_segment_id': 0}
+
+    def save_manifest(self):
+        # Write to a temporary file first so an interrupted write never corrupts the manifest
+        metrics.write_atomically(self.manifest_file, json.dumps(self.manifest, indent=4))
+
+    def has_compacted_file(self):
+        return os.path.exists(self.file_name) and os.path.getsize(self.file_name) > 0
+
+    def get_columns(self):
+        import pandas as pd
+
+        if self.manifest['columns'] is not None:
+            return self.manifest['columns']
+        if self.has_compacted_file():
+            return pd.read_csv(self.file_name, nrows=0).columns.tolist()
+        return None
+
+    def get_segment_files(self):
+        return [os.path.join(self.segment_dir, segment['file']) for segment in self.manifest['segments']]
+
+    def append(self, data_frame, is_sorted=False):
+        columns = self.get_columns()
+        if columns is not None and columns != data_frame.columns.tolist():
+            raise ValueError(f"Columns {data_frame.columns.tolist()} do not match the dataset columns {columns}")
+
+        # sort the new data points by the dependent variable, unless the caller already did
+        if not is_sorted:
+            with metrics.stage('sorting'):
+                data_frame = data_frame.sort_values(by=data_frame.columns[0], kind='stable')
+
+        # Check if the folder exists, if not create it
+        if os.path.dirname(self.file_name) and not os.path.exists(os.path.dirname(self.file_name)):
+            os.makedirs(os.path.dirname(self.file_name))
+
+        # The first batch of a new dataset is already compacted
+        if columns is None:
+            self.write_atomically(data_frame, self.file_name)
+            return self.file_name
+
+        if not os.path.exists(self.segment_dir):
+            os.makedirs(self.segment_dir)
+
+        segment_name = f"segment_{self.manifest['next_segment_id']:06d}.csv"
+        self.write_atomically(data_frame, os.path.join(self.segment_dir, segment_name))
+
+        self.manifest['columns'] = data_frame.columns.tolist()
+        self.manifest['segments'].append({'file': segment_name, 'rows': len(data_frame)})
+        self.manifest['next_segment_id'] += 1
+        self.save_manifest()
+        return os.path.join(self.segment_dir, segment_name)
+
+    @staticmethod
+    def write_atomically(data_frame, file_name):
+        # An interrupted write leaves only the temporary file behind, never a half-written data file
+        temp_file = file_name + '.tmp'
+        with metrics.stage('writing'):
+            data_frame.to_csv(temp_file, index=False)
+            os.replace(temp_file, file_name)
+        metrics.increment('bytes_written', os.path.getsize(file_name))
+
+    def load_data_frame(self):
+        import pandas as pd
+
+        # Read the compacted file and every pending segment, the result is not sorted across segments
+        files = [self.file_name] if self.has_compacted_file() else []
+        files += self.get_segment_files()
+        if not files:
+            return pd.DataFrame()
+        with metrics.stage('loading'):
+            return pd.concat([pd.read_csv(file, float_precision='round_trip') for file in files], ignore_index=True)
+
+    def iter_chunks(self, chunk_size, usecols=None):
+        import pandas as pd
+
+        # Read the compacted file and every pending segment in data frames of at most chunk_size rows
+        files = [self.file_name] if self.has_compacted_file() else []
+        files += self.get_segment_files()
+        for file in files:
+            with pd.read_csv(file, usecols=usecols, chunksize=chunk_size, float_precision='round_trip') as reader:
+                while True:
+                    with metrics.stage('loading'):
+                        data_frame = next(reader, None)
+                    if data_frame is None:
+                        break
+                    yield data_frame
+
+    def is_sorted(self, chunk_size=1_000_000):
+        import pandas as pd
+
+        # Segments are always sorted, but the compacted file is not when it was streamed without --sort
+        previous_key = -np.inf
+        with pd.read_csv(self.file_name, usecols=[0], chunksize=chunk_size, dtype=np.float64,
+                         float_precision='round_trip') as reader:
+            for data_frame in reader:
+                keys = data_frame.iloc[:, 0].to_numpy()
+                if len(keys) == 0:
+                    continue
+                # NaN keys compare as unsorted, the external sort puts them last
+                if not (keys[0] >= previous_key and np.all(keys[1:] >= keys[:-1])):
+                    return False
+                previous_key = keys[-1]
+        return True
+
+    def compact(self, memory_budget=None, chunk_size=1_000_000):
+        segment_files = self.get_segment_files()
+        if not segment_files:
+            return self.file_name
+
+        temp_file = self.file_name + '.tmp'
+        with metrics.stage('compaction'):
+            if self.has_compacted_file() and not self.is_sorted(chunk_size):
+                self.sort_into(temp_file, memory_budget, chunk_size)
+            else:
+                self.merge_into(temp_file)
+
+        os.replace(temp_file, self.file_name)
+        self.clear_segments()
+        return self.file_name
+
+    def merge_into(self, temp_file):
+        files = [self.file_name] if self.has_compacted_file() else []
+        files += self.get_segment_files()
+
+        # Every file is sorted on its first column, so a k-way merge of the lines keeps the result sorted
+        # while holding only one line per file in memory
+        readers = [open(file, 'r') for file in files]
+        try:
+            with open(temp_file, 'w') as output:
+                for reader in readers:
+                    header = reader.readline()
+                output.write(header)
+                rows = heapq.merge(*readers, key=lambda line: float(line.split(',', 1)[0]))
+                for row in rows:
+                    output.write(row if row.endswith('\n') else row + '\n')
+        finally:
+            for reader in readers:
+                reader.close()
+
+    def sort_into(self, temp_file, memory_budget=None, chunk_size=1_000_000):
+        import pandas as pd
+        from src.util.external_sort import DEFAULT_MEMORY_BUDGET, external_sort
+
+        # Sort the compacted file and the segments together out of core, the stable sort keeps rows with equal
+        # keys in the order they were appended
+        columns = self.get_columns()
+        chunks = (data_frame.to_numpy(dtype=np.float64) for data_frame in self.iter_chunks(chunk_size))
+        with open(temp_file, 'w', newline='') as output:
+            output.write(','.join(columns) + '\n')
+            for chunk in external_sort(chunks, memory_budget or DEFAULT_MEMORY_BUDGET,
+                                       os.path.dirname(os.path.abspath(self.file_name))):
+                pd.DataFrame(chunk, columns=columns, copy=False).to_csv(output, header=False, index=False)
+
+    def clear_segments(self):
+        for segment_file in self.get_segment_files():
+            if os.path.exists(segment_file):
+                os.remove(segment_file)
+        if os.path.exists(self.manifest_file):
+            os.remove(self.manifest_file)
+        if os.path.isdir(self.segment_dir) and not os.listdir(self.segment_dir):
+            os.rmdir(self.segment_dir)
+        self.manifest = {'columns': None, 'segments': [], 'next_segment_id': 0}
+
+
+def split_columns(data_frame):
+    # The first column is the dependent variable, the others are keyed by the symbol in their "symbol (unit)" header
+    dependent_column = data_frame[data_frame.columns[0]].to_numpy(dtype=np.float64)
+    independent_columns = {column_name.split(' ')[0]: data_frame[column_name].to_numpy(dtype=np.float64)
+                           for column_name in data_frame.columns[1:]}
+    return dependent_column, independent_columns
+
+
+def get_dataset_columns(file_name):
+    if is_columnar_path(file_name):
+        return ColumnarDataset(file_name).get_columns()
+    return DatasetStore(file_name).get_columns()
+
+
+def get_current_dataset_path(file_name):
+    # The columnar copy next to a csv file is only read while it is up to date: written after the csv file and
+    # with no segments appended to the csv file since. A columnar path asked for explicitly is always used.
+    columnar_path = get_columnar_path(file_name)
+    header_file = os.path.join(columnar_path, HEADER_FILE)
+    if is_columnar_path(file_name) or not os.path.exists(header_file) or DatasetStore(file_name).get_segment_files():
+        return file_name
+    if os.path.exists(file_name) and os.path.getmtime(header_file) <= os.path.getmtime(file_name):
+        return file_name
+    return columnar_path
+
+
+def load_columns(file_name):
+    # Columnar datasets are memory-mapped, csv datasets are parsed including their pending segments
+    if is_columnar_path(file_name):
+        return ColumnarDataset(file_name).load_columns()
+    return split_columns(DatasetStore(file_name).load_data_frame())
+
+
+def iter_column_chunks(file_name, chunk_size):
+    if is_columnar_path(file_name):
+        yield from ColumnarDataset(file_name).iter_column_chunks(chunk_size)
+        return
+    for data_frame in DatasetStore(file_name).iter_chunks(chunk_size):
+        yield split_columns(data_frame)
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def sort_by_x(x_values, y_values):
+    x_values = np.asarray(x_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    if len(x_values) > 1 and np.any(np.diff(x_values) < 0):
+        order = np.argsort(x_values, kind='stable')
+        return x_values[order], y_values[order]
+    return x_values, y_values
+
+
+def lttb(x_values, y_values, num_points):
+    # Largest-Triangle-Three-Buckets: keep the point of every bucket that spans the largest triangle with the
+    # point kept in the previous bucket and the average of the next bucket, which preserves the visual shape
+    x_values, y_values = sort_by_x(x_values, y_values)
+    if num_points >= len(x_values) or num_points < 3:
+        return x_values, y_values
+
+    edges = np.linspace(1, len(x_values) - 1, num_points - 1).astype(np.int64)
+    selected = np.empty(num_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = len(x_values) - 1
+    previous = 0
+    for i in range(num_points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else len(x_values)
+        average_x = np.mean(x_values[next_start:max(next_end, next_start + 1)])
+        average_y = np.mean(y_values[next_start:max(next_end, next_start + 1)])
+
+        areas = np.abs((x_values[previous] - average_x) * (y_values[start:end] - y_values[previous])
+                       - (x_values[previous] - x_values[start:end]) * (average_y - y_values[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return x_values[selected], y_values[selected]
+
+
+def min_max_downsample(x_values, y_values, num_bins):
+    # Keep the lowest and the highest point of every bin along x, so no peak disappears from a line plot
+    x_values, y_values = sort_by_x(x_values, y_values)
+    if 2 * num_bins >= len(x_values):
+        return x_values, y_values
+
+    starts = np.linspace(0, len(x_values), num_bins, endpoint=False).astype(np.int64)
+    bins = np.split(y_values, starts[1:])
+    min_index = starts + np.array([np.argmin(y) for y in bins])
+    max_index = starts + np.array([np.argmax(y) for y in bins])
+
+    selected = np.unique(np.concatenate([min_index, max_index]))
+    return x_values[selected], y_values[selected]
+
+
+def quantile_sketch(values, num_quantiles=1000):
+    # Summarise the distribution by a fixed number of evenly spaced quantiles, enough for a Q-Q plot
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    probabilities = (np.arange(1, num_quantiles + 1) - 0.5) / num_quantiles
+    if len(values) == 0:
+        return probabilities, np.full(num_quantiles, np.nan)
+    return probabilities, np.quantile(values, probabilities)
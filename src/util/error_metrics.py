@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def calculate_metrics(expected_result, fitted_result):
+    expected_result = np.asarray(expected_result, dtype=np.float64)
+    fitted_result = np.asarray(fitted_result, dtype=np.float64)
+
+    # Calculate the Residuals
+    residuals = fitted_result - expected_result
+
+    SSR = np.sum(residuals ** 2)
+    SST = np.sum((expected_result - np.mean(expected_result)) ** 2)
+
+    return {
+        'ssr': float(SSR),
+        'sst': float(SST),
+        'r_squared': float(1 - (SSR / SST)) if SST > 0 else float('nan'),
+        'rmse': float(np.sqrt(SSR / len(residuals))) if len(residuals) > 0 else float('nan'),
+        'max_error': float(np.max(np.abs(residuals))) if len(residuals) > 0 else float('nan'),
+    }
+
+
+class ErrorAccumulator:
+    # Accumulates the error metrics of a model one chunk at a time, so the test set never has to fit in memory.
+    # A bounded reservoir keeps a uniform sample of the residuals for the diagnostic plots.
+    def __init__(self, reservoir_size=10000, seed=None):
+        self.count = 0
+        self.ssr = 0.0
+        self.absolute_error_sum = 0.0
+        self.max_error = float('-inf')
+        # Running mean and sum of squared deviations of the expected values, merged with Chan's update
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        self.reservoir_size = reservoir_size
+        self.fitted_sample = np.empty(reservoir_size, dtype=np.float64)
+        self.residual_sample = np.empty(reservoir_size, dtype=np.float64)
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, expected_result, fitted_result):
+        expected_result = np.asarray(expected_result, dtype=np.float64)
+        fitted_result = np.asarray(fitted_result, dtype=np.float64)
+        chunk_count = len(expected_result)
+        if chunk_count == 0:
+            return
+
+        residuals = fitted_result - expected_result
+        self.ssr += float(np.sum(residuals ** 2))
+        self.absolute_error_sum += float(np.sum(np.abs(residuals)))
+        self.max_error = max(self.max_error, float(np.max(np.abs(residuals))))
+
+        chunk_mean = float(np.mean(expected_result))
+        chunk_m2 = float(np.sum((expected_result - chunk_mean) ** 2))
+        total_count = self.count + chunk_count
+        delta = chunk_mean - self.mean
+        self.mean += delta * chunk_count / total_count
+        self.m2 += chunk_m2 + delta ** 2 * self.count * chunk_count / total_count
+
+        self.update_reservoir(fitted_result, residuals)
+        self.count = total_count
+
+    def update_reservoir(self, fitted_result, residuals):
+        # Fill the reservoir first, then replace random entries with decreasing probability (algorithm R)
+        filled = min(self.count, self.reservoir_size)
+        take = min(self.reservoir_size - filled, len(residuals))
+        self.fitted_sample[filled:filled + take] = fitted_result[:take]
+        self.residual_sample[filled:filled + take] = residuals[:take]
+
+        positions = np.arange(self.count + take, self.count + len(residuals))
+        if len(positions) == 0:
+            return
+        slots = self.rng.integers(0, positions + 1)
+        for i in np.flatnonzero(slots < self.reservoir_size):
+            self.fitted_sample[slots[i]] = fitted_result[take + i]
+            self.residual_sample[slots[i]] = residuals[take + i]
+
+    def get_residual_sample(self):
+        filled = min(self.count, self.reservoir_size)
+        return self.fitted_sample[:filled].copy(), self.residual_sample[:filled].copy()
+
+    def get_metrics(self):
+        if self.count == 0:
+            return {'count': 0, 'ssr': 0.0, 'sst': 0.0, 'r_squared': float('nan'), 'rmse': float('nan'),
+                    'mae': float('nan'), 'max_error': float('nan')}
+        return {
+            'count': self.count,
+            'ssr': self.ssr,
+            'sst': self.m2,
+            'r_squared': 1 - self.ssr / self.m2 if self.m2 > 0 else float('nan'),
+            'rmse': float(np.sqrt(self.ssr / self.count)),
+            'mae': self.absolute_error_sum / self.count,
+            'max_error': self.max_error,
+        }
@@ -0,0 +1,120 @@
+import itertools
+import os
+import tempfile
+
+import numpy as np
+
+from src.util import metrics
+from src.util.columnar_store import allocate_columns
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+def get_rows_for_budget(memory_budget, num_columns):
+    # Number of float64 rows that fit in the memory budget. Sorting a block in place needs the rows, the argsort
+    # indices, the merge buffer of the stable argsort (at most as large as the indices) and one reordered column.
+    row_bytes = (num_columns + 1) * np.dtype(np.float64).itemsize + 2 * np.dtype(np.intp).itemsize
+    return max(1, memory_budget // row_bytes)
+
+
+def sort_block(block):
+    # Sort the rows in place one column at a time, so only the indices and a single column are allocated.
+    # Stable so rows with equal keys keep their input order.
+    order = np.argsort(block[:, 0], kind='stable')
+    for i in range(block.shape[1]):
+        block[:, i] = block[order, i]
+    return block
+
+
+def split_into_runs(chunks, rows_per_run, num_columns):
+    # Copy the incoming chunks into one preallocated block of rows_per_run rows, which is yielded whenever it is
+    # full. The block is reused for the next run, so every run must be consumed before the next one is requested.
+    block = allocate_columns(rows_per_run, num_columns)
+    buffered_rows = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        start = 0
+        while start < len(chunk):
+            take = min(rows_per_run - buffered_rows, len(chunk) - start)
+            block[buffered_rows:buffered_rows + take] = chunk[start:start + take]
+            buffered_rows += take
+            start += take
+            if buffered_rows == rows_per_run:
+                yield block
+                buffered_rows = 0
+    if buffered_rows > 0:
+        yield block[:buffered_rows]
+
+
+def get_merge_key(key, run):
+    if np.isnan(key):
+        return True, 0.0, run
+    return False, key, run
+
+
+def merge_runs(run_files, block_rows):
+    # Rows are ordered by (key, run, position in run), which is the input order for equal keys
+    runs = [np.load(run_file, mmap_mode='r') for run_file in run_files]
+    positions = [0] * len(runs)
+    buffers = [np.array(run[:block_rows]) for run in runs]
+
+    while True:
+        active = [i for i, buffer in enumerate(buffers) if len(buffer) > 0]
+        if not active:
+            return
+
+        # The smallest last key (ties broken by run) bounds what every run can safely emit now,
+        # NaN keys sort last like they do in np.argsort
+        bound_run = min(active, key=lambda i: get_merge_key(buffers[i][-1, 0], i))
+        bound_key = buffers[bound_run][-1, 0]
+
+        pieces = []
+        for i in active:
+            side = 'right' if i <= bound_run else 'left'
+            count = np.searchsorted(buffers[i][:, 0], bound_key, side=side)
+            pieces.append(buffers[i][:count])
+            buffers[i] = buffers[i][count:]
+
+            # Refill a drained buffer from its run file
+            if len(buffers[i]) == 0:
+                positions[i] += block_rows
+                buffers[i] = np.array(runs[i][positions[i]:positions[i] + block_rows])
+
+        # Pieces are copied in run order, so a stable sort keeps equal keys in input order
+        with metrics.stage('merging'):
+            block = allocate_columns(sum(len(piece) for piece in pieces), runs[0].shape[1])
+            start = 0
+            for piece in pieces:
+                block[start:start + len(piece)] = piece
+                start += len(piece)
+            block = sort_block(block)
+        yield block
+
+
+def external_sort(chunks, memory_budget=DEFAULT_MEMORY_BUDGET, temp_dir=None):
+    # Sort blocks of rows on the first column in memory, spill them as sorted runs and merge the runs.
+    # Yields sorted blocks so that the caller can stream them to the output file.
+    chunks = iter(chunks)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return
+    num_columns = np.shape(first_chunk)[1]
+    rows_per_run = get_rows_for_budget(memory_budget, num_columns)
+    # Only the runs hold on to the rows, the first chunk is released once it has been copied
+    chunks = itertools.chain([first_chunk], chunks)
+    del first_chunk
+
+    with tempfile.TemporaryDirectory(prefix='external_sort_', dir=temp_dir) as run_dir:
+        run_files = []
+        for run in split_into_runs(chunks, rows_per_run, num_columns):
+            run_file = os.path.join(run_dir, f'run_{len(run_files):06d}.npy')
+            with metrics.stage('sorting'):
+                sort_block(run)
+            with metrics.stage('spilling'):
+                np.save(run_file, run)
+            run_files.append(run_file)
+
+        # The merge holds one read buffer per run, the block being merged and the block the caller is still
+        # writing, each of them at most as large as all the read buffers together
+        block_rows = max(1, rows_per_run // (3 * len(run_files)))
+        yield from merge_runs(run_files, block_rows)
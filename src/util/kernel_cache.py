@@ -0,0 +1,310 @@
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import tempfile
+import types
+from importlib import metadata
+
+# Bump when the layout of the cache entries changes, old entries are then never read again
+FORMAT_VERSION = 4
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def get_default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'physics-data-generator', 'kernels')
+
+
+class KernelCache:
+    # Stores the generated source of compiled formula kernels on disk, keyed by a hash of everything the source
+    # depends on. Entries are evicted least recently used first once the cache grows beyond max_bytes.
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir or os.environ.get('PHYSICS_DATA_GENERATOR_CACHE_DIR') or get_default_cache_dir()
+        self.max_bytes = max_bytes
+        self.enabled = enabled and os.environ.get('PHYSICS_DATA_GENERATOR_KERNEL_CACHE', '1') != '0'
+
+    @staticmethod
+    def get_key(equation, symbols, constants, backend='numpy'):
+        # Any change of the equation, the variables, the constants, the backend or sympy gives a new key.
+        # The constants keep their order, it is the order of the kernel arguments.
+        content = json.dumps({
+            'format_version': FORMAT_VERSION,
+            'sympy_version': get_sympy_version(),
+            'equation': equation,
+            'symbols': list(symbols),
+            'constants': [(name, repr(value)) for name, value in constants.items()],
+            'backend': backend,
+        })
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry_path = self.get_entry_path(key)
+        try:
+            with open(entry_path, 'r') as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError):
+            # A corrupted entry is dropped and compiled again
+            self.remove(entry_path)
+            return None
+        try:
+            # Mark the entry as recently used, a read-only or shared cache keeps its entries anyway
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry if entry.get('key') == key else None
+
+    def put(self, key, entry):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so concurrent readers never see a partial entry
+            file_descriptor, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(file_descriptor, 'w') as file:
+                json.dump(dict(entry, key=key), file)
+            os.replace(temp_file, self.get_entry_path(key))
+            self.evict()
+        except OSError:
+            # The cache is only an optimization, a read-only or full disk must not break compiling
+            pass
+
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.json'):
+                entry_path = os.path.join(self.cache_dir, file_name)
+                try:
+                    status = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, entry_path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self.remove(entry_path)
+            total_bytes -= size
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                self.remove(os.path.join(self.cache_dir, file_name))
+
+    @staticmethod
+    def remove(entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+
+_sympy_version = None
+
+
+def get_sympy_version():
+    # Read from the package metadata, so a cache hit never has to import sympy
+    global _sympy_version
+    if _sympy_version is None:
+        try:
+            _sympy_version = metadata.version('sympy')
+        except metadata.PackageNotFoundError:
+            _sympy_version = 'unknown'
+    return _sympy_version
+
+
+def get_referenced_names(code):
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= get_referenced_names(constant)
+    return names
+
+
+def describe_globals(function):
+    # Record where every global used by the generated function comes from, so it can be rebuilt without sympy
+    references = {}
+    for name in get_referenced_names(function.__code__):
+        if name not in function.__globals__:
+            continue
+        value = function.__globals__[name]
+        if isinstance(value, types.ModuleType):
+            references[name] = {'module': value.__name__}
+        elif isinstance(value, (int, float, complex)) and not isinstance(value, bool):
+            references[name] = {'value': repr(value)}
+        else:
+            references[name] = {'module': getattr(value, '__module__', None),
+                                'attribute': getattr(value, '__name__', None)}
+            if resolve_reference(references[name]) is not value:
+                return None
+    return references
+
+
+def resolve_reference(reference):
+    try:
+        if 'value' in reference:
+            return complex(reference['value']) if 'j' in reference['value'] else float(reference['value'])
+        module = importlib.import_module(reference['module'])
+        if 'attribute' not in reference:
+            return module
+        return getattr(module, reference['attribute'])
+    except (ImportError, AttributeError, TypeError, ValueError):
+        return None
+
+
+def load_kernel(entry):
+    namespace = {name: resolve_reference(reference) for name, reference in entry['globals'].items()}
+    exec(compile(entry['source'], '<formula kernel>', 'exec'), namespace)
+    kernel = namespace[entry['function_name']]
+    if entry.get('backend') == 'numba':
+        kernel = vectorize_kernel(kernel, entry['num_args'])
+    return kernel
+
+
+def vectorize_kernel(kernel, num_args):
+    import numba
+
+    # Compile the scalar kernel to a ufunc, the columns are then evaluated in a single compiled loop
+    signature = f"float64({', '.join(['float64'] * num_args)})"
+    return numba.vectorize([signature], nopython=True)(kernel)
+
+
+def parse_equation(equation, symbols, constants):
+    import sympy
+
+    # Map every variable symbol to a plain sympy Symbol so names such as 'E', 'I' or 'S'
+    # are not mistaken for sympy built-ins while parsing. Constants become trailing arguments,
+    # so their exact float values are bound when the kernel is loaded instead of being printed into the source.
+    sympy_symbols = [sympy.Symbol(symbol) for symbol in symbols]
+    constant_symbols = [sympy.Symbol(constant) for constant in constants]
+    local_symbols = {symbol.name: symbol for symbol in constant_symbols + sympy_symbols}
+    return sympy_symbols + constant_symbols, sympy.sympify(equation, locals=local_symbols)
+
+
+def eliminate_common_subexpressions(expressions):
+    import sympy
+
+    # Repeated terms are computed once. Reciprocals are inlined again, so divisions are printed and rounded
+    # exactly like in the plain expression.
+    # A single expression is reduced to a single expression, like sympy.cse(expression, list=False)
+    replacements, reduced = sympy.cse(expressions, list=False)
+    kept = []
+    inlined = {}
+    for symbol, subexpression in replacements:
+        subexpression = subexpression.xreplace(inlined)
+        if subexpression.is_Pow and subexpression.exp.is_negative:
+            inlined[symbol] = subexpression
+        else:
+            kept.append((symbol, subexpression))
+    if isinstance(reduced, list):
+        return kept, [expression.xreplace(inlined) for expression in reduced]
+    return kept, reduced.xreplace(inlined)
+
+
+def get_numexpr_source(arguments, expression, function_name):
+    import sympy
+    from sympy.printing.lambdarepr import NumExprPrinter
+
+    # numexpr finds the arguments and the common subexpressions in the locals of the calling function.
+    # It has no constants such as pi, they are written as floats with enough digits to round-trip.
+    printer = NumExprPrinter()
+    expression = expression.xreplace({constant: sympy.Float(float(constant), 17)
+                                      for constant in expression.atoms(sympy.NumberSymbol)})
+    replacements, (reduced,) = eliminate_common_subexpressions([expression])
+    lines = [f"def {function_name}({', '.join(str(argument) for argument in arguments)}):"]
+    for symbol, subexpression in replacements:
+        lines.append(f"    {symbol} = {printer.doprint(subexpression)}")
+    lines.append(f"    return {printer.doprint(reduced)}")
+    return '\n'.join(lines) + '\n'
+
+
+def is_exactly_rounded_expression(expression):
+    import sympy
+
+    # The operations of backends.is_exactly_rounded, checked again because sympy rewrites some equations,
+    # e.g. x*x*x into x**3. Powers are not normalized, so an equation sympy turns into x**-2 or x**3, such as
+    # x/y/y, is always evaluated with numpy.
+    for node in sympy.preorder_traversal(expression):
+        if node.is_Pow:
+            if node.exp not in (-1, 2, sympy.S.Half):
+                return False
+        elif not (node.is_Add or node.is_Mul or node.is_Symbol or isinstance(node, sympy.Abs)
+                  or (node.is_Atom and node.is_real)):
+            return False
+    return True
+
+
+def lambdify_equation(equation, symbols, constants, backend='numpy'):
+    import sympy
+
+    arguments, equation_expr = parse_equation(equation, symbols, constants)
+    if backend != 'numpy' and not is_exactly_rounded_expression(equation_expr):
+        raise ValueError(f"The {backend} backend does not round {equation} exactly like numpy")
+    if backend == 'numexpr':
+        function_name = '_numexpr_kernel'
+        entry = {'source': get_numexpr_source(arguments, equation_expr, function_name),
+                 'function_name': function_name, 'globals': {'numexpr': {'module': 'numexpr'}}}
+        return load_kernel(entry), entry
+    if backend == 'numba':
+        # A scalar kernel on the math module, vectorized by numba when loaded
+        kernel = sympy.lambdify(arguments, equation_expr, modules='math', cse=eliminate_common_subexpressions)
+        return kernel, {'backend': backend, 'num_args': len(arguments)}
+    # The numpy kernel goes through the same common subexpression elimination, so every backend evaluates
+    # the same operations in the same order
+    return sympy.lambdify(arguments, equation_expr, modules='numpy', cse=eliminate_common_subexpressions), {}
+
+
+def bind_constants(kernel, constants):
+    if not constants:
+        return kernel
+    values = tuple(constants.values())
+
+    def bound_kernel(*columns):
+        return kernel(*columns, *values)
+    return bound_kernel
+
+
+def compile_kernel(equation, symbols, constants, cache=None, backend='numpy'):
+    # constants only holds the constants bound in this equation, see ConstantHandler.get_constant_bindings
+    cache = cache if cache is not None else default_kernel_cache
+    key = cache.get_key(equation, symbols, constants, backend)
+
+    entry = cache.get(key)
+    if entry is not None:
+        try:
+            return bind_constants(load_kernel(entry), constants)
+        except Exception:
+            # Fall through and compile the equation again
+            pass
+
+    try:
+        kernel, entry = lambdify_equation(equation, symbols, constants, backend)
+    except Exception as e:
+        raise ValueError(f"Error compiling the equation: {e}")
+
+    if 'source' not in entry:
+        # lambdify keeps the source of the functions it generates in linecache
+        try:
+            source = inspect.getsource(kernel)
+        except (OSError, TypeError):
+            source = None
+        entry.update({'source': source, 'function_name': kernel.__name__, 'globals': describe_globals(kernel)})
+    if entry['source'] is not None and entry['globals'] is not None:
+        cache.put(key, entry)
+    if entry.get('backend') == 'numba':
+        kernel = vectorize_kernel(kernel, entry['num_args'])
+    return bind_constants(kernel, constants)
+
+
+default_kernel_cache = KernelCache()
@@ -0,0 +1,175 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the reports then have no peak resident memory
+    resource = None
+
+# Comma separated profilers to enable, e.g. PHYSICS_DATA_GENERATOR_PROFILE=cprofile,tracemalloc
+PROFILE_ENVIRONMENT_VARIABLE = 'PHYSICS_DATA_GENERATOR_PROFILE'
+PROFILERS = ('cprofile', 'tracemalloc')
+
+
+class RunMetrics:
+    # Named stage timers and counters of one run, safe to update from several threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start_time)
+
+    def add_stage(self, name, seconds, calls=1):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += calls
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_counter(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def merge(self, snapshot):
+        # Add the metrics recorded by another process or thread
+        for name, stage in snapshot['stages'].items():
+            self.add_stage(name, stage['seconds'], stage['calls'])
+        for name, value in snapshot['counters'].items():
+            self.increment(name, value)
+
+    def get_report(self):
+        report = self.snapshot()
+        report['wall_seconds'] = time.perf_counter() - self.start_time
+        rows_sampled = report['counters'].get('rows_sampled')
+        if rows_sampled:
+            report['acceptance_rate'] = 1 - report['counters'].get('rows_rejected', 0) / rows_sampled
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            report['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        if tracemalloc.is_tracing():
+            report['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        return report
+
+    def write_report(self, file_name):
+        write_atomically(file_name, json.dumps(self.get_report(), indent=4))
+
+    def write_prometheus_textfile(self, file_name, labels=None):
+        # Text exposition format read by the node exporter textfile collector
+        report = self.get_report()
+        label_text = ','.join(f'{key}="{value}"' for key, value in sorted((labels or {}).items()))
+        lines = [
+            '# HELP physics_data_generator_stage_seconds Time spent in each stage of the run.',
+            '# TYPE physics_data_generator_stage_seconds gauge',
+        ]
+        for name, stage in sorted(report['stages'].items()):
+            lines.append(f'physics_data_generator_stage_seconds{{{join_labels(label_text, name)}}} '
+                         f'{stage["seconds"]}')
+        lines += [
+            '# HELP physics_data_generator_stage_calls Number of times each stage ran.',
+            '# TYPE physics_data_generator_stage_calls gauge',
+        ]
+        for name, stage in sorted(report['stages'].items()):
+            lines.append(f'physics_data_generator_stage_calls{{{join_labels(label_text, name)}}} {stage["calls"]}')
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f'# TYPE physics_data_generator_{name} gauge')
+            lines.append(f'physics_data_generator_{name}{{{label_text}}} {value}')
+        for name in ('wall_seconds', 'peak_rss_bytes', 'tracemalloc_peak_bytes'):
+            if name in report:
+                lines.append(f'# TYPE physics_data_generator_{name} gauge')
+                lines.append(f'physics_data_generator_{name}{{{label_text}}} {report[name]}')
+        write_atomically(file_name, '\n'.join(lines) + '\n')
+
+
+def join_labels(label_text, stage_name):
+    stage_label = f'stage="{stage_name}"'
+    return f'{label_text},{stage_label}' if label_text else stage_label
+
+
+def write_atomically(file_name, content):
+    # Readers such as the textfile collector or a resumed batch run must never see a half-written file
+    temp_file = file_name + '.tmp'
+    with open(temp_file, 'w') as file:
+        file.write(content)
+    os.replace(temp_file, file_name)
+
+
+_current_metrics = RunMetrics()
+
+
+def get_metrics():
+    return _current_metrics
+
+
+@contextlib.contextmanager
+def use_metrics(metrics):
+    # Record into another RunMetrics, e.g. to return the metrics of a shard from a worker process
+    global _current_metrics
+    previous_metrics = _current_metrics
+    _current_metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _current_metrics = previous_metrics
+
+
+def stage(name):
+    return get_metrics().stage(name)
+
+
+def increment(name, value=1):
+    get_metrics().increment(name, value)
+
+
+def get_enabled_profilers(profilers=None):
+    if profilers is None:
+        profilers = os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, '')
+    if isinstance(profilers, str):
+        profilers = [profiler.strip() for profiler in profilers.split(',') if profiler.strip()]
+    unknown = [profiler for profiler in profilers if profiler not in PROFILERS]
+    if unknown:
+        raise ValueError(f"Unknown profilers: {', '.join(unknown)}, expected {', '.join(PROFILERS)}")
+    return profilers
+
+
+@contextlib.contextmanager
+def profile(profilers=None, output_prefix='profile'):
+    # Optionally capture a cProfile dump and the top tracemalloc allocations of the enclosed code
+    profilers = get_enabled_profilers(profilers)
+    profiler = cProfile.Profile() if 'cprofile' in profilers else None
+    if 'tracemalloc' in profilers:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output_prefix + '.prof')
+        if 'tracemalloc' in profilers:
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:25]
+            write_atomically(output_prefix + '.tracemalloc.txt', '\n'.join(str(line) for line in statistics) + '\n')
+            get_metrics().set_counter('tracemalloc_peak_bytes', tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
@@ -0,0 +1,111 @@
+import warnings
+
+import numpy as np
+
+SAMPLING_METHODS = ('uniform', 'sobol', 'halton', 'latin-hypercube')
+SCALES = ('linear', 'log', 'auto')
+# With the auto scale, non-negative ranges spanning at least this many decades are sampled log-uniformly
+AUTO_LOG_DECADES = 3
+# A lower bound of zero cannot be sampled log-uniformly, it is replaced by this many decades below the upper bound
+LOG_ZERO_DECADES = 12
+# The centered discrepancy is quadratic in the number of rows, larger datasets are subsampled
+MAX_DISCREPANCY_POINTS = 4096
+
+
+class Sampler:
+    def __init__(self, method='uniform', scale='linear'):
+        if method not in SAMPLING_METHODS:
+            raise ValueError(f"Sampling method must be one of {', '.join(SAMPLING_METHODS)}, got: {method}")
+        if scale not in SCALES:
+            raise ValueError(f"Scale must be one of {', '.join(SCALES)}, got: {scale}")
+        self.method = method
+        self.scale = scale
+
+    def __repr__(self):
+        return f"Sampler(method={self.method}, scale={self.scale})"
+
+    def is_default(self):
+        return self.method == 'uniform' and self.scale == 'linear'
+
+    def sample(self, domains, n, rng=None, bound_for_inf=10000):
+        # rng can be a numpy Generator or a seed, the quasi-random sequences are scrambled with it
+        rng = np.random.default_rng(rng)
+        if self.is_default():
+            # Keep the exact random stream of plain uniform sampling
+            return [domain.sample(n, rng, bound_for_inf) for domain in domains]
+
+        unit_points = self.sample_unit_cube(n, len(domains), rng)
+        return [self.from_unit(domain, unit_points[:, i], bound_for_inf) for i, domain in enumerate(domains)]
+
+    def sample_unit_cube(self, n, dimensions, rng):
+        if self.method == 'uniform' or dimensions == 0:
+            return rng.random((n, dimensions))
+
+        from scipy.stats import qmc
+
+        if self.method == 'sobol':
+            engine = qmc.Sobol(dimensions, scramble=True, seed=rng)
+        elif self.method == 'halton':
+            engine = qmc.Halton(dimensions, scramble=True, seed=rng)
+        else:
+            engine = qmc.LatinHypercube(dimensions, seed=rng)
+        with warnings.catch_warnings():
+            # Sobol warns when n is not a power of two, the rows are still well spread
+            warnings.simplefilter('ignore', UserWarning)
+            return engine.random(n)
+
+    def uses_log_scale(self, domain, lower_bound, upper_bound):
+        # Only non-negative real ranges are sampled log-uniformly
+        if self.scale == 'linear' or domain.type != 'real' or lower_bound < 0 or upper_bound <= 0:
+            return False
+        if self.scale == 'log':
+            return True
+        return lower_bound == 0 or upper_bound / lower_bound >= 10 ** AUTO_LOG_DECADES
+
+    @staticmethod
+    def get_log_bounds(lower_bound, upper_bound):
+        lower_bound = max(lower_bound, upper_bound * 10.0 ** -LOG_ZERO_DECADES)
+        return np.log10(lower_bound), np.log10(upper_bound)
+
+    def from_unit(self, domain, unit_values, bound_for_inf=10000):
+        # Map values in [0, 1) to the domain of a variable
+        lower_bound, upper_bound = domain.get_finite_bounds(bound_for_inf)
+        if domain.type == 'integer':
+            lower_bound, upper_bound = int(lower_bound), int(upper_bound)
+            values = np.floor(lower_bound + unit_values * (upper_bound - lower_bound + 1))
+            return np.minimum(values, upper_bound).astype(np.int64)
+
+        elif domain.type != 'real':
+            raise ValueError(f"Unsupported domain type: {domain.type}")
+
+        if self.uses_log_scale(domain, lower_bound, upper_bound):
+            log_lower_bound, log_upper_bound = self.get_log_bounds(lower_bound, upper_bound)
+            return 10.0 ** (log_lower_bound + unit_values * (log_upper_bound - log_lower_bound))
+        return lower_bound + unit_values * (upper_bound - lower_bound)
+
+    def to_unit(self, domain, values, bound_for_inf=10000):
+        # Inverse of from_unit, used to measure how well the rows cover the domain
+        lower_bound, upper_bound = domain.get_finite_bounds(bound_for_inf)
+        values = np.asarray(values, dtype=np.float64)
+        if domain.type == 'integer':
+            lower_bound, upper_bound = lower_bound, upper_bound + 1
+        elif self.uses_log_scale(domain, lower_bound, upper_bound):
+            lower_bound, upper_bound = self.get_log_bounds(lower_bound, upper_bound)
+            values = np.log10(np.maximum(values, 10.0 ** lower_bound))
+        if upper_bound == lower_bound:
+            return np.full(len(values), 0.5)
+        return np.clip((values - lower_bound) / (upper_bound - lower_bound), 0, 1)
+
+
+def calculate_discrepancy(unit_points, max_points=MAX_DISCREPANCY_POINTS, seed=0):
+    # Centered L2 discrepancy of points in the unit cube, lower values mean a more even coverage
+    from scipy.stats import qmc
+
+    unit_points = np.asarray(unit_points, dtype=np.float64)
+    if len(unit_points) > max_points:
+        rows = np.random.default_rng(seed).choice(len(unit_points), max_points, replace=False)
+        unit_points = unit_points[rows]
+    return float(qmc.discrepancy(unit_points, method='CD'))
+
+
+default_sampler = Sampler()
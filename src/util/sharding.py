@@ -0,0 +1,64 @@
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+
+def get_shards(num_rows, shard_size, seed=None):
+    # The shards only depend on the row count, the shard size and the seed, never on the number of workers,
+    # so every shard gets the same independent random stream however the work is scheduled
+    if shard_size < 1:
+        raise ValueError("Shard size must be at least 1.")
+    sizes = [min(shard_size, num_rows - start) for start in range(0, num_rows, shard_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(sizes))
+    return list(zip(sizes, seed_sequences))
+
+
+def get_worker_count(workers):
+    # 0 or None means one worker per cpu
+    if not workers:
+        return os.cpu_count() or 1
+    return workers
+
+
+def map_in_order(function, tasks, workers=1):
+    # Run the tasks on a process pool and yield the results in task order. At most two tasks per worker
+    # are in flight, so the results never pile up in memory when the consumer is slower than the pool.
+    workers = get_worker_count(workers)
+    if workers == 1:
+        for task in tasks:
+            yield function(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(function, *task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def map_as_completed(function, tasks, workers=1):
+    # Like map_in_order, but yield every result as soon as its task finishes so one slow task
+    # does not hold back the results of the tasks scheduled after it
+    workers = get_worker_count(workers)
+    if workers == 1:
+        for task in tasks:
+            yield function(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for task in tasks:
+            pending.add(executor.submit(function, *task))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
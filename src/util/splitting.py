@@ -0,0 +1,52 @@
+import numpy as np
+
+SPLIT_RULES = ('random', 'stratified', 'held-out')
+DEFAULT_TESTING_RATIO = 0.2
+
+
+class Splitter:
+    # Routes the rows of one generation pass to the training and testing splits, chunk by chunk
+    def __init__(self, testing_ratio=DEFAULT_TESTING_RATIO, rule='random', seed=None, get_held_out_position=None):
+        if not 0 < testing_ratio < 1:
+            raise ValueError(f"Testing ratio must be between 0 and 1, got: {testing_ratio}")
+        if rule not in SPLIT_RULES:
+            raise ValueError(f"Split rule must be one of {', '.join(SPLIT_RULES)}, got: {rule}")
+        if rule == 'held-out' and get_held_out_position is None:
+            raise ValueError("The held-out rule needs the position of the rows in the held-out variable's range.")
+        self.testing_ratio = testing_ratio
+        self.rule = rule
+        self.rng = np.random.default_rng(seed)
+        # Maps the rows to their position in [0, 1] of the held-out variable's range
+        self.get_held_out_position = get_held_out_position
+        self.rows_seen = 0
+
+    def __repr__(self):
+        return f"Splitter(testing_ratio={self.testing_ratio}, rule={self.rule})"
+
+    def get_num_testing_rows(self, num_rows):
+        # The first n rows always hold int(n * ratio) testing rows, whatever the chunk sizes are
+        start = self.rows_seen
+        return int((start + num_rows) * self.testing_ratio) - int(start * self.testing_ratio)
+
+    def get_testing_mask(self, data_points):
+        num_rows = len(data_points)
+        mask = np.zeros(num_rows, dtype=bool)
+        if self.rule == 'held-out':
+            # The top of the held-out variable's range is kept for testing, to measure extrapolation
+            mask = self.get_held_out_position(data_points) >= 1 - self.testing_ratio
+        else:
+            num_testing = self.get_num_testing_rows(num_rows)
+            if self.rule == 'random':
+                mask[self.rng.choice(num_rows, num_testing, replace=False)] = True
+            elif num_testing > 0:
+                # Evenly spaced rows in the order of the dependent variable, so both splits cover its whole range
+                order = np.argsort(data_points[:, 0], kind='stable')
+                positions = ((np.arange(num_testing) + self.rng.random()) * num_rows / num_testing).astype(np.int64)
+                mask[order[np.minimum(positions, num_rows - 1)]] = True
+
+        self.rows_seen += num_rows
+        return mask
+
+    def split(self, data_points):
+        mask = self.get_testing_mask(data_points)
+        return {'training': data_points[~mask], 'testing': data_points[mask]}
@@ -1,15 +1,18 @@
 import sys
 
-import numpy as np
-import pandas as pd
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QLabel, QPushButton, QWidget, \
-    QDesktopWidget, QComboBox, QLineEdit
-from matplotlib import pyplot as plt
-import statsmodels.api as sm
+    QDesktopWidget, QComboBox, QLineEdit, QMessageBox
 
 from src.formula_loader import FormulaLoader
-from src.util.constant_handler import ConstantHandler
+from src.plotter import plot_residual_diagnostics
+from src.entity.regressed_model import RegressedModel
+from src.util.dataset_store import get_current_dataset_path, get_dataset_columns, iter_column_chunks
+from src.util.error_metrics import ErrorAccumulator
+
+# Rows of the test file scored at a time and residuals kept for the diagnostic plots
+CHUNK_SIZE = 1_000_000
+RESIDUAL_SAMPLE_SIZE = 100_000
 
 
 class ModelVerifier(QMainWindow):
@@ -18,7 +21,7 @@ class ModelVerifier(QMainWindow):
 
         # Load formulas using FormulaLoader
         formula_loader = FormulaLoader('../data/formulae/formulae.json')
-        self.formulas = formula_loader.load_formulas()
+        self.formulas = formula_loader.list_formulas()
 
         # Set up the main window
         self.setWindowTitle('Model Verifier')
@@ -86,111 +89,62 @@ class ModelVerifier(QMainWindow):
 
             self.selected_formula_label.setText(f"{self.selected_formula_label.text()}\n{variable_info}")
 
-    def calculate_results(self):
+    def get_test_file_path(self):
         # Get the selected formula name from the drop-down list
         selected_formula = self.formula_dropdown.currentText()
         # Replace spaces with underscores and remove special characters
         selected_formula = selected_formula.replace(' ', '_').replace(':', '')
 
-        # Figure out the file path based on the selected formula name
-        file_path = f'../data/testing_data/{selected_formula}.csv'
-
-        loaded_data = pd.read_csv(file_path)
-        # get the first column of the data as the dependent variable
-        expected_result = loaded_data[loaded_data.columns[0]].tolist()
-
-        independent_variables = [column_name for column_name in loaded_data.columns[1:]]
-        independent_variables = [variable.split(' ')[0] for variable in independent_variables]
-
-        input_variables = loaded_data[loaded_data.columns[1:]].values.tolist()
-
-        regressed_model = self.model_input.text()
-        regressed_model = self.clean_formula(regressed_model)
+        # Figure out the file path based on the selected formula name, an up-to-date columnar copy is read instead
+        return get_current_dataset_path(f'../data/testing_data/{selected_formula}.csv')
 
-        regressed_result = []
+    def get_regressed_model(self, variable_symbols):
+        # Parse the model once so it can be evaluated over whole columns
+        return RegressedModel(self.clean_formula(self.model_input.text()), variable_symbols)
 
-        # For each row in the input variables, replace the independent variables with the values in the row
-        for row in input_variables:
-            # Make a copy of the regressed model
-            regressed_model_copy = regressed_model
+    def accumulate_error(self, chunk_size=CHUNK_SIZE):
+        file_path = self.get_test_file_path()
+        variable_symbols = [column_name.split(' ')[0] for column_name in (get_dataset_columns(file_path) or [])[1:]]
+        regressed_model = self.get_regressed_model(variable_symbols)
 
-            # Replace the independent variables with the values in the row, add a bracket to each value
-            for i in range(len(independent_variables)):
-                regressed_model_copy = regressed_model_copy.replace(independent_variables[i], f"({str(row[i])})")
-
-            print(regressed_model_copy)
-            # Evaluate the regressed model
-            regressed_result.append(eval(regressed_model_copy))
-
-        # Calculate the number of data points (n) and the number of independent variables (p)
-
-        return expected_result, regressed_result
+        # Score the test file one chunk at a time, only a bounded sample of the residuals is kept for the plots
+        accumulator = ErrorAccumulator(RESIDUAL_SAMPLE_SIZE)
+        for expected_result, input_columns in iter_column_chunks(file_path, chunk_size):
+            accumulator.update(expected_result, regressed_model.evaluate(input_columns))
+        return accumulator
 
     def clean_formula(self, formula):
-        formula = formula.replace('^', '**')
-
-        if '=' in formula:
-            formula = formula.split('=')[1]
-
-        if '≈' in formula:
-            formula = formula.split('≈')[1]
-
-        formula = ConstantHandler.handle_constant_in_equation(formula)
-
-        return formula
+        return RegressedModel.clean_expression(formula)
 
     def calculate_error(self):
-        # Call the calculate_results function to get the expected and regressed results
-        expected_result, fitted_result = self.calculate_results()
-
-        print(f"Expected Result: {expected_result}")
-        print(f"Fitted Result: {fitted_result}")
-
-        # Convert the results to numpy arrays for easier computation
-        expected_result = np.array(expected_result)
-        fitted_result = np.array(fitted_result)
-
-        # Calculate the Residuals
-        residuals = fitted_result - expected_result
-
-        print(f"Residuals: {residuals}")
-
-        SSR = np.sum((fitted_result - expected_result) ** 2)
-        SST = np.sum((expected_result - np.mean(expected_result)) ** 2)
-
-        print(f"SSR: {SSR}")
-        print(f"SST: {SST}")
+        # Accumulate the errors of the regressed model over the whole test set
+        try:
+            accumulator = self.accumulate_error()
+        except (ValueError, FileNotFoundError) as e:
+            QMessageBox.warning(self, 'Invalid Model', str(e))
+            return None
+
+        metrics = accumulator.get_metrics()
+        print(f"Data points: {metrics['count']}")
+        print(f"SSR: {metrics['ssr']}")
+        print(f"SST: {metrics['sst']}")
+        print(f"MAE: {metrics['mae']}")
+        print(f"Max Error: {metrics['max_error']}")
 
         # Calculate the R-squared value
-        r_squared = 1 - (SSR / SST)
+        r_squared = metrics['r_squared']
 
         print(f"R-squared: {r_squared}")
 
-        # Plot the graphs
+        # Plot the graphs from a uniform sample of the residuals
+        fitted_result, residuals = accumulator.get_residual_sample()
         self.plot_graphs(residuals, fitted_result)
 
         return residuals, r_squared
 
     def plot_graphs(self, residuals, fitted_result):
-        # Residuals vs. Fitted Values Plot
-        plt.figure(figsize=(8, 6))
-        plt.scatter(fitted_result, residuals, c='blue', marker='o', edgecolors='black')
-        plt.axhline(y=0, color='red', linestyle='--')
-        plt.xlabel('Fitted Values')
-        plt.ylabel('Residuals')
-        plt.title('Residuals vs. Fitted Values Plot')
-        # tight layout
-        plt.tight_layout()
-        plt.show()
-
-        # Normal Q-Q Plot
-        sm.qqplot(residuals, line='s')
-        plt.xlabel('Theoretical Quantiles')
-        plt.ylabel('Standardized Residuals')
-        plt.title('Normal Q-Q Plot of Residuals')
-        # tight layout
-        plt.tight_layout()
-        plt.show()
+        # Large samples are drawn as a density plot and a quantile-sketch Q-Q plot
+        plot_residual_diagnostics(residuals, fitted_result)
 
     def center_window(self):
         # Get the size of the screen
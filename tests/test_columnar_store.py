@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+from src.util.columnar_store import REPLACED_SUFFIX, ColumnarDataset, append_columnar, write_columnar
+
+COLUMNS = ['C (F)', 'q (C)', 'V (V)']
+
+
+def leave_aside(path):
+    # What a crash between the two renames of replace_directory leaves behind
+    os.replace(path, path + REPLACED_SUFFIX)
+
+
+def test_append_keeps_a_dataset_left_aside(tmp_path):
+    path = str(tmp_path / 'data.cols')
+    data_points = np.arange(3000, dtype=np.float64).reshape(1000, 3)
+    write_columnar(path, data_points, COLUMNS)
+    leave_aside(path)
+
+    append_columnar(path, np.full((10, 3), 5000.0), COLUMNS)
+
+    dataset = ColumnarDataset(path)
+    assert len(dataset) == 1010
+    assert dataset.path == path
+    assert not os.path.exists(path + REPLACED_SUFFIX)
+
+
+def test_write_replaces_a_dataset_left_aside(tmp_path):
+    path = str(tmp_path / 'data.cols')
+    write_columnar(path, np.zeros((1000, 3)), COLUMNS)
+    leave_aside(path)
+
+    write_columnar(path, np.ones((10, 3)), COLUMNS)
+
+    assert len(ColumnarDataset(path)) == 10
+    assert not os.path.exists(path + REPLACED_SUFFIX)